@@ -0,0 +1,177 @@
+"""Runs Strands agent turns for every browser session on a shared, bounded worker pool.
+
+Streamlit re-executes app.py on every rerun, redefining its classes, while the executor
+lives for the whole process in st.cache_resource. Keeping the executor and its exception
+in this module means they are defined once per process, so `except AgentBusyError` in
+app.py matches what the cached executor raises.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+logger = logging.getLogger("iot_agent_demo")
+
+
+class AgentBusyError(Exception):
+    """Raised when an agent turn is rejected because the executor queue is full or the
+    session's previous turn is still running."""
+
+
+class AgentExecutor:
+    """Runs agent turns for every browser session on a bounded worker pool.
+
+    At most `max_workers` turns call the model at once and at most `max_queued` more may
+    wait for a worker; anything beyond that is rejected with AgentBusyError instead of
+    tying up another thread. A session runs one turn at a time: a turn submitted while
+    its agent is still busy is rejected rather than holding a worker while it waits. Each
+    turn passes its own callback handler so concurrent sessions never share one.
+
+    Turn counts, latencies and token usage are recorded in `metrics`, the app's
+    MetricsRegistry.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int, metrics):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-turn")
+        self._lock = threading.Lock()
+        self._agent_locks = weakref.WeakKeyDictionary()
+        self._in_flight = 0
+        self._queued = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue_wait_ms = deque(maxlen=1000)
+        self._metrics = metrics
+        self._metrics.add_collector(lambda: [
+            ("agent_turns_in_flight", {}, self._in_flight),
+            ("agent_turns_queued", {}, self._queued)
+        ])
+
+    def submit(self, agent, prompt: str, callback_handler) -> Future:
+        """Queue an agent turn.
+
+        Args:
+            agent: The session's agent
+            prompt: The user's message
+            callback_handler: Receives the streaming events for this turn
+
+        Returns:
+            A Future resolving to the AgentResult
+
+        Raises:
+            AgentBusyError: If the queue is full or the agent is still running a turn
+        """
+        with self._lock:
+            agent_lock = self._agent_locks.setdefault(agent, threading.Lock())
+            # The agent's lock is taken here and released by the worker when the turn ends
+            if not agent_lock.acquire(blocking=False):
+                self._rejected += 1
+                self._metrics.inc("agent_turns_total", status="rejected")
+                raise AgentBusyError("The previous message is still being answered")
+            if self._queued + self._in_flight >= self.max_workers + self.max_queued:
+                agent_lock.release()
+                self._rejected += 1
+                self._metrics.inc("agent_turns_total", status="rejected")
+                raise AgentBusyError(f"Agent queue is full ({self._queued} turns waiting)")
+            self._queued += 1
+
+        # Worker threads need the session's script run context to update its Streamlit elements
+        ctx = get_script_run_ctx()
+        try:
+            return self._pool.submit(self._run_turn, agent, agent_lock, prompt, callback_handler, ctx, time.perf_counter())
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            agent_lock.release()
+            raise
+
+    def update_agent(self, agent, update) -> bool:
+        """Change an agent outside a turn, e.g. add messages answered without the model.
+
+        Args:
+            agent: The session's agent
+            update: Called with the agent while holding its lock
+
+        Returns:
+            True if the update was applied, False if the agent is running a turn
+        """
+        with self._lock:
+            agent_lock = self._agent_locks.setdefault(agent, threading.Lock())
+        if not agent_lock.acquire(blocking=False):
+            return False
+        try:
+            update(agent)
+        finally:
+            agent_lock.release()
+        return True
+
+    def _run_turn(self, agent, agent_lock, prompt, callback_handler, ctx, submitted_at):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            started_at = time.perf_counter()
+            queue_wait_ms = (started_at - submitted_at) * 1000
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+                self._queue_wait_ms.append(queue_wait_ms)
+            self._metrics.observe("agent_queue_wait_ms", queue_wait_ms)
+
+            # The agent's usage counters are cumulative; holding its lock makes the difference this turn's
+            usage_before = dict(agent.event_loop_metrics.accumulated_usage)
+            model_latency_before = agent.event_loop_metrics.accumulated_metrics['latencyMs']
+            status = "error"
+            try:
+                agent.callback_handler = callback_handler
+                result = agent(prompt)
+                status = "ok"
+                return result
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+                self._record_turn(agent, status, started_at, usage_before, model_latency_before)
+        finally:
+            agent_lock.release()
+
+    def _record_turn(self, agent, status, started_at, usage_before, model_latency_before):
+        turn_ms = (time.perf_counter() - started_at) * 1000
+        usage = agent.event_loop_metrics.accumulated_usage
+        tokens = {kind: usage[f'{kind}Tokens'] - usage_before[f'{kind}Tokens'] for kind in ('input', 'output')}
+        model_latency_ms = agent.event_loop_metrics.accumulated_metrics['latencyMs'] - model_latency_before
+
+        self._metrics.inc("agent_turns_total", status=status)
+        self._metrics.observe("agent_turn_latency_ms", turn_ms)
+        self._metrics.observe("model_latency_ms", model_latency_ms)
+        for kind, count in tokens.items():
+            self._metrics.inc("model_tokens_total", count, type=kind)
+        logger.info("Agent turn", extra={
+            'event': 'agent_turn',
+            'status': status,
+            'duration_ms': round(turn_ms, 1),
+            'model_latency_ms': model_latency_ms,
+            'input_tokens': tokens['input'],
+            'output_tokens': tokens['output']
+        })
+
+    def stats(self) -> dict:
+        """Return gauges for in-flight and queued turns and the recent queue wait times."""
+        with self._lock:
+            waits = sorted(self._queue_wait_ms)
+            stats = {
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'completed': self._completed,
+                'rejected': self._rejected
+            }
+        stats['queue_wait_p50_ms'] = round(waits[len(waits) // 2], 1) if waits else None
+        stats['queue_wait_p95_ms'] = round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else None
+        return stats
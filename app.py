@@ -1,305 +1,3011 @@
-import streamlit as st
-import boto3
-import json
+from __future__ import annotations
+
 import time
-from datetime import datetime
-from strands import Agent, tool
+
+# Start of the first script run, for the startup profile
+MODULE_LOAD_STARTED = time.perf_counter()
+
+import streamlit as st
 import asyncio
-from streamlit.runtime.scriptrunner import add_script_run_ctx
-from botocore.exceptions import ClientError
+import atexit
+import bisect
+import contextlib
+import functools
+import hashlib
+import http.server
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import typing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Objects kept in st.cache_resource outlive the rerun that created them, so their classes
+# live in modules imported once per process rather than in this script
+from agent_executor import AgentBusyError, AgentExecutor
+from device_commands import CommandDebouncer, CommandOutbox, CommandScheduler
+
+EAGER_IMPORTS_MS = (time.perf_counter() - MODULE_LOAD_STARTED) * 1000
+
+# Background pre-warming of the deferred imports and clients after the first page load,
+# and an optional file the startup profile is written to once pre-warming finishes
+STARTUP_PREWARM = os.environ.get("STARTUP_PREWARM", "true").lower() in ("1", "true", "yes")
+STARTUP_PROFILE_FILE = os.environ.get("STARTUP_PROFILE_FILE", "")
+
+
+class StartupProfile:
+    """Records how long imports, client creation and the first page load take.
+
+    Only the first measurement of each step is kept, so reruns and later sessions don't
+    overwrite the cold-start numbers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    def record(self, kind: str, name: str, duration_ms: float):
+        """Record a step's duration unless it was already recorded."""
+        with self._lock:
+            self._timings.setdefault((kind, name), round(duration_ms, 1))
+
+    @contextlib.contextmanager
+    def measure(self, kind: str, name: str):
+        """Time the body of a with block as a step."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, (time.perf_counter() - start) * 1000)
+
+    def has(self, kind: str, name: str) -> bool:
+        with self._lock:
+            return (kind, name) in self._timings
+
+    def report(self) -> dict:
+        """Return the recorded durations in milliseconds, grouped by kind."""
+        report = {}
+        with self._lock:
+            for (kind, name), duration_ms in self._timings.items():
+                report.setdefault(kind, {})[name] = duration_ms
+        return report
+
+    def export(self, path: str):
+        """Write the report to a JSON file."""
+        with open(path, "w") as profile_file:
+            json.dump(self.report(), profile_file, indent=2)
+
+
+@st.cache_resource
+def get_startup_profile() -> StartupProfile:
+    """Return the process-wide startup profile."""
+    return StartupProfile()
+
+
+get_startup_profile().record("import", "eager (streamlit, numpy)", EAGER_IMPORTS_MS)
+
+
+class LazyModule:
+    """A module that is only imported when one of its attributes is first used.
+
+    The heavy SDKs (boto3, Strands, pandas) are loaded this way so the first page load
+    doesn't pay for them; the import time is recorded in the startup profile.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            # A module in sys.modules may still be being imported by another thread, e.g. the
+            # pre-warming one; import_module waits for that import to finish
+            if self._name in sys.modules:
+                self._module = importlib.import_module(self._name)
+            else:
+                with get_startup_profile().measure("import", self._name):
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+boto3 = LazyModule("boto3")
+botocore_config = LazyModule("botocore.config")
+pd = LazyModule("pandas")
+strands = LazyModule("strands")
+strands_models = LazyModule("strands.models")
+strands_conversation_manager = LazyModule("strands.agent.conversation_manager")
+strands_tool_executors = LazyModule("strands.tools.executors")
+
+# Logging settings: LOG_FORMAT is 'json' for one structured object per line, or 'text'
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+# Vehicles logged at DEBUG level each time the full fleet is read
+LOG_VEHICLE_SAMPLE_SIZE = int(os.environ.get("LOG_VEHICLE_SAMPLE_SIZE", "5"))
+
+# Metrics exporters: serve Prometheus text on METRICS_PORT at /metrics, and/or write it to
+# METRICS_FILE every METRICS_EXPORT_SECONDS
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_EXPORT_SECONDS = float(os.environ.get("METRICS_EXPORT_SECONDS", "15"))
+
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+SIZE_BUCKETS_BYTES = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats a log record as one JSON object, including any fields passed with `extra`."""
+
+    STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.STANDARD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+logger = logging.getLogger("iot_agent_demo")
+# Streamlit reruns this script, so only configure the logger once per process
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(log_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+class MetricsRegistry:
+    """Thread-safe counters and fixed-bucket histograms, exported in the Prometheus text format.
+
+    Recording a value is a dictionary update and a bisect under a lock, cheap enough to
+    leave on for every tool call and publish. Subsystems with their own statistics add
+    a collector, which is only called on export.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: tuple = LATENCY_BUCKETS_MS):
+        """Declare a 'counter', 'histogram' or 'gauge' metric and its help text."""
+        self._descriptions[name] = (kind, help_text, buckets)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a value in a histogram."""
+        buckets = self._descriptions[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def add_collector(self, collector):
+        """Add a callable returning (name, labels, value) gauge samples, called on each export."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collect_gauges(self) -> list:
+        samples = []
+        for collector in list(self._collectors):
+            try:
+                samples.extend(collector())
+            except Exception:
+                logger.exception("Metrics collector failed")
+        return samples
+
+    def snapshot(self) -> dict:
+        """Return counters, histogram counts and means, and gauges as a dictionary."""
+        def label_text(name, labels):
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+        with self._lock:
+            counters = {label_text(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+            histograms = {
+                label_text(name, labels): {'count': h['count'], 'mean': round(h['sum'] / h['count'], 2) if h['count'] else None}
+                for (name, labels), h in sorted(self._histograms.items())
+            }
+        gauges = {label_text(name, tuple(sorted(labels.items()))): value for name, labels, value in self._collect_gauges()}
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def render_prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._descriptions.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, {**h, 'buckets': list(h['buckets'])}) for key, h in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(list(self._descriptions[name][2]) + ["+Inf"], histogram['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{label_text(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{label_text(labels)} {histogram['count']}")
+        for name, labels, value in sorted(self._collect_gauges(), key=lambda sample: sample[0]):
+            header(name, "gauge")
+            lines.append(f"{name}{label_text(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource
+def get_metrics() -> MetricsRegistry:
+    """Return the process-wide metrics registry with the app's metrics declared."""
+    metrics = MetricsRegistry()
+    metrics.describe("tool_calls_total", "counter", "Agent tool calls by tool and status")
+    metrics.describe("tool_latency_ms", "histogram", "Agent tool call latency in milliseconds")
+    metrics.describe("tool_timeouts_total", "counter", "Agent tool calls that exceeded their timeout")
+    metrics.describe("iot_publishes_total", "counter", "IoT Core publishes by topic and status")
+    metrics.describe("iot_publish_latency_ms", "histogram", "IoT Core publish latency in milliseconds")
+    metrics.describe("iot_payload_bytes", "histogram", "IoT Core publish payload size in bytes", SIZE_BUCKETS_BYTES)
+    metrics.describe("agent_turns_total", "counter", "Agent turns by status")
+    metrics.describe("agent_turn_latency_ms", "histogram", "Agent turn latency in milliseconds, excluding queue wait")
+    metrics.describe("agent_queue_wait_ms", "histogram", "Time agent turns waited for a worker in milliseconds")
+    metrics.describe("model_latency_ms", "histogram", "Bedrock model latency per agent turn in milliseconds")
+    metrics.describe("model_tokens_total", "counter", "Bedrock model tokens by type")
+    metrics.describe("tool_specs_sent_total", "counter", "Tool specs sent with model requests")
+    metrics.describe("tool_specs_skipped_total", "counter", "Tool specs left out of model requests by tool selection")
+    metrics.describe("tool_spec_tokens_saved_total", "counter", "Estimated input tokens saved by tool selection")
+    metrics.describe("outbox_enqueued_total", "counter", "Device commands queued on the outbox by topic")
+    metrics.describe("outbox_coalesced_total", "counter", "Queued device commands replaced by a newer command before publishing")
+    metrics.describe("outbox_published_total", "counter", "Device commands published from the outbox by topic")
+    metrics.describe("outbox_retries_total", "counter", "Device command publishes retried after throttling or a transient error")
+    metrics.describe("outbox_failed_total", "counter", "Device commands dropped after a permanent error or too many attempts")
+    metrics.describe("outbox_delay_ms", "histogram", "Time from queueing a device command to publishing it in milliseconds")
+    metrics.describe("fast_path_total", "counter", "Chat messages by fast-path intent, 'none' when they went to the agent")
+    metrics.describe("fast_path_latency_ms", "histogram", "Time to answer a chat message on the fast path in milliseconds")
+    return metrics
+
+
+def write_metrics_file(metrics: MetricsRegistry, path: str, interval_seconds: float):
+    """Write the metrics to a file every interval, replacing it atomically."""
+    while True:
+        try:
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "w") as metrics_file:
+                metrics_file.write(metrics.render_prometheus())
+            os.replace(temporary_path, path)
+        except Exception:
+            logger.exception("Error writing metrics file", extra={'path': path})
+        time.sleep(interval_seconds)
+
+
+@st.cache_resource
+def start_metrics_exporters() -> dict:
+    """Start the /metrics HTTP endpoint and the metrics file writer if configured, once per process."""
+    metrics = get_metrics()
+    exporters = {}
+
+    if METRICS_PORT:
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are frequent; don't log each one
+                pass
+
+        server = http.server.ThreadingHTTPServer(("", METRICS_PORT), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        exporters['http'] = server
+        logger.info("Serving metrics", extra={'port': METRICS_PORT})
+
+    if METRICS_FILE:
+        exporters['file'] = threading.Thread(
+            target=write_metrics_file,
+            args=(metrics, METRICS_FILE, METRICS_EXPORT_SECONDS),
+            name="metrics-file",
+            daemon=True
+        )
+        exporters['file'].start()
+
+    return exporters
+
+
+# IoT Data Plane publisher settings (override with environment variables)
+IOT_PUBLISH_POOL_SIZE = int(os.environ.get("IOT_PUBLISH_POOL_SIZE", "10"))
+IOT_CREDENTIAL_REFRESH_SECONDS = int(os.environ.get("IOT_CREDENTIAL_REFRESH_SECONDS", "300"))
+
+# How a new timed command for a device combines with one already pending: 'merge' keeps
+# the later deadline, 'cancel' replaces the pending command with the new one
+COMMAND_OVERLAP_POLICY = os.environ.get("COMMAND_OVERLAP_POLICY", "merge")
+
+# Registry device key of the cat feeder, used by the scheduler and the Cat Feeder tab
+CAT_FEEDER_DEVICE = "cat_feeder"
+
+# Longest timed feed, so a bad duration can't leave the feeder running indefinitely
+TIMED_FEED_MAX_SECONDS = 3600
+
+# A repeat of a device's last command within this many seconds is dropped
+COMMAND_DEBOUNCE_SECONDS = float(os.environ.get("COMMAND_DEBOUNCE_SECONDS", "1.0"))
+
+# Command outbox settings: publishes per second and burst size for the whole account and for
+# each topic, kept below the account's IoT Core quotas, and concurrent publishes, kept at or
+# below IOT_PUBLISH_POOL_SIZE
+OUTBOX_ACCOUNT_RATE = float(os.environ.get("OUTBOX_ACCOUNT_RATE", "200"))
+OUTBOX_ACCOUNT_BURST = float(os.environ.get("OUTBOX_ACCOUNT_BURST", "100"))
+OUTBOX_TOPIC_RATE = float(os.environ.get("OUTBOX_TOPIC_RATE", "50"))
+OUTBOX_TOPIC_BURST = float(os.environ.get("OUTBOX_TOPIC_BURST", "50"))
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", str(IOT_PUBLISH_POOL_SIZE)))
+
+# Publish attempts per command, and the backoff before the first retry, doubling up to the maximum
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get("OUTBOX_RETRY_BASE_SECONDS", "0.2"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get("OUTBOX_RETRY_MAX_SECONDS", "10"))
+
+# SQLite file keeping queued commands across restarts, in memory only if unset
+OUTBOX_DB_FILE = os.environ.get("OUTBOX_DB_FILE", "")
+
+# Recent commands whose outcome can be looked up by command ID
+OUTBOX_STATUS_HISTORY = int(os.environ.get("OUTBOX_STATUS_HISTORY", "10000"))
+
+# Device registry: the topics, devices, commands and groups the agent can control. Each
+# device command becomes an agent tool; see devices.json
+DEVICE_REGISTRY_FILE = os.environ.get("DEVICE_REGISTRY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices.json"))
+
+
+class IoTPublisher:
+    """Shared, thread-safe publisher for the AWS IoT Data Plane.
+
+    One boto3 session and 'iot-data' client are created per process and reused by every
+    tool call, so endpoint resolution, the credential chain lookup and the TLS handshake
+    are paid once instead of on every button press. HTTP connections are kept alive in a
+    pool of `pool_size` connections, and credentials are refreshed on a background thread
+    so a refresh never lands on the publish path.
+    """
+
+    def __init__(self, pool_size: int = IOT_PUBLISH_POOL_SIZE, refresh_seconds: int = IOT_CREDENTIAL_REFRESH_SECONDS):
+        self.pool_size = pool_size
+        with get_startup_profile().measure("client", "iot-data"):
+            self._session = boto3.session.Session()
+            self._client = self._session.client(
+                'iot-data',
+                config=botocore_config.Config(max_pool_connections=pool_size, tcp_keepalive=True)
+            )
+        self._lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=1000)
+        self._publish_count = 0
+        self._error_count = 0
+        self._metrics = get_metrics()
+
+        # Refresh credentials ahead of expiry on a daemon thread
+        self._refresh_seconds = refresh_seconds
+        self._stop_event = threading.Event()
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_credentials_loop,
+            name="iot-credential-refresh",
+            daemon=True
+        )
+        self._refresh_thread.start()
+
+    def _refresh_credentials_loop(self):
+        while not self._stop_event.wait(self._refresh_seconds):
+            try:
+                credentials = self._session.get_credentials()
+                if credentials is not None:
+                    # Reading frozen credentials makes botocore refresh them if they are close to expiry
+                    credentials.get_frozen_credentials()
+            except Exception:
+                logger.exception("Error refreshing IoT publisher credentials")
+
+    def publish(self, topic: str, payload, qos: int = 1) -> tuple:
+        """Publish a message to an IoT topic.
+
+        Args:
+            topic: The MQTT topic to publish to
+            payload: The message, either a JSON string or a JSON-serializable object
+            qos: Quality of Service, 1 means at least once delivery
+
+        Returns:
+            A tuple of the IoT publish response and the publish latency in milliseconds
+        """
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+
+        self._metrics.observe("iot_payload_bytes", len(payload), topic=topic)
+        start = time.perf_counter()
+        try:
+            response = self._client.publish(topic=topic, qos=qos, payload=payload)
+        except Exception:
+            with self._lock:
+                self._error_count += 1
+            self._metrics.inc("iot_publishes_total", topic=topic, status="error")
+            raise
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._publish_count += 1
+            self._latencies_ms.append(latency_ms)
+        self._metrics.observe("iot_publish_latency_ms", latency_ms, topic=topic)
+        self._metrics.inc("iot_publishes_total", topic=topic, status="ok")
+        return response, latency_ms
+
+    def stats(self) -> dict:
+        """Return publish counts and latency percentiles over the most recent publishes."""
+        with self._lock:
+            latencies = sorted(self._latencies_ms)
+            publish_count = self._publish_count
+            error_count = self._error_count
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 1)
+
+        return {
+            'publishes': publish_count,
+            'errors': error_count,
+            'pool_size': self.pool_size,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'max_ms': round(latencies[-1], 1) if latencies else None
+        }
+
+    def close(self):
+        self._stop_event.set()
+
+
+@st.cache_resource
+def get_iot_publisher() -> IoTPublisher:
+    """Return the process-wide IoT publisher, created on first use."""
+    return IoTPublisher()
+
+
+@st.cache_resource
+def get_command_scheduler() -> CommandScheduler:
+    """Return the process-wide command scheduler, created on first use.
+
+    The scheduler doesn't create the command outbox; the commands it runs do, when they
+    run, so showing its pending commands doesn't load boto3 or create the IoT client.
+    """
+    return CommandScheduler(COMMAND_OVERLAP_POLICY)
+
+
+@st.cache_resource
+def get_command_debouncer() -> CommandDebouncer:
+    """Return the process-wide command debouncer, created on first use."""
+    debouncer = CommandDebouncer(COMMAND_DEBOUNCE_SECONDS)
+    get_metrics().add_collector(lambda: [("commands_debounced", {}, debouncer.suppressed)])
+    return debouncer
+
+
+@st.cache_resource
+def get_command_outbox() -> CommandOutbox:
+    """Return the process-wide command outbox, created on first use."""
+    outbox = CommandOutbox(
+        get_iot_publisher(), get_metrics(), get_command_debouncer(),
+        account_rate=OUTBOX_ACCOUNT_RATE, account_burst=OUTBOX_ACCOUNT_BURST,
+        topic_rate=OUTBOX_TOPIC_RATE, topic_burst=OUTBOX_TOPIC_BURST,
+        workers=OUTBOX_WORKERS, max_attempts=OUTBOX_MAX_ATTEMPTS,
+        retry_base_seconds=OUTBOX_RETRY_BASE_SECONDS, retry_max_seconds=OUTBOX_RETRY_MAX_SECONDS,
+        db_path=OUTBOX_DB_FILE, status_history=OUTBOX_STATUS_HISTORY
+    )
+    # Exit handlers run in reverse order, so the scheduler's pending commands are run and
+    # queued before the outbox drains
+    atexit.register(get_command_scheduler().flush)
+
+    def gauges():
+        queued, in_flight = outbox.depth()
+        return [("outbox_queued", {}, queued), ("outbox_in_flight", {}, in_flight)]
+
+    get_metrics().add_collector(gauges)
+    return outbox
+
+
+def render_payload_template(payload_template: dict, device: str) -> dict:
+    """Fill a payload template for one device, replacing '{device}' in string values with the device name."""
+    return {
+        key: value.format(device=device) if isinstance(value, str) else value
+        for key, value in payload_template.items()
+    }
+
+
+class FanOutPublisher:
+    """Sends one command to many devices by queueing it on the command outbox for each device.
+
+    The outbox publishes the commands concurrently within its rate limits, so the call
+    returns as soon as every device's command is queued.
+    """
+
+    def __init__(self, outbox: CommandOutbox, debouncer: CommandDebouncer):
+        self._outbox = outbox
+        self._debouncer = debouncer
+
+    def publish(self, devices: list, payload_template: dict) -> dict:
+        """Queue a payload template for every device.
+
+        Args:
+            devices: A list of {'device': name, 'topic': topic} dicts
+            payload_template: The payload, with '{device}' in string values replaced per device
+
+        Returns:
+            A dict with counts of queued, debounced and failed commands, the wall-clock time
+            and a per-device result with its command ID or error
+        """
+        start = time.perf_counter()
+        results = [self._publish_one(target, payload_template) for target in devices]
+        return {
+            'devices': len(results),
+            'queued': sum(1 for r in results if r['status'] == 'queued'),
+            'debounced': sum(1 for r in results if r['status'] == 'debounced'),
+            'failed': sum(1 for r in results if r['status'] == 'error'),
+            'wall_ms': round((time.perf_counter() - start) * 1000, 1),
+            'results': results
+        }
+
+    def _publish_one(self, target: dict, payload_template: dict) -> dict:
+        device = target['device']
+        topic = target['topic']
+        message_json = json.dumps(render_payload_template(payload_template, device))
+        if not self._debouncer.should_send(device, topic, message_json):
+            return {'device': device, 'topic': topic, 'status': 'debounced'}
+        try:
+            queued = self._outbox.enqueue(device, topic, message_json)
+        except Exception as e:
+            self._debouncer.forget(device, topic, message_json)
+            return {'device': device, 'topic': topic, 'status': 'error', 'error': str(e)}
+        return {'device': device, 'topic': topic, 'status': 'queued', 'command_id': queued['command_id']}
+
+
+@st.cache_resource
+def get_fan_out_publisher() -> FanOutPublisher:
+    """Return the process-wide fan-out publisher, created on first use."""
+    return FanOutPublisher(get_command_outbox(), get_command_debouncer())
+
+
+def publish_to_group(group: str, payload_template: dict) -> dict:
+    """Publish a payload template to every device in a device registry group.
+
+    Args:
+        group: The group name
+        payload_template: The command, merged over the group's own payload template
+
+    Returns:
+        The FanOutPublisher result with the group name added
+
+    Raises:
+        ValueError: If the group is unknown
+    """
+    if group not in DEVICE_GROUPS:
+        raise ValueError(f"Unknown device group: {group}. Must be one of: {', '.join(DEVICE_GROUPS)}")
+    definition = DEVICE_GROUPS[group]
+    result = get_fan_out_publisher().publish(definition['devices'], {**definition['payload_template'], **payload_template})
+    result['group'] = group
+    return result
+
+
+# Measurements tracked for every vehicle, one column array per measurement
+TELEMETRY_MEASUREMENTS = (
+    'temperature', 'humidity', 'light',
+    'latitude', 'longitude', 'altitude',
+    'pitch', 'roll', 'x', 'y', 'z'
+)
+
+# Telemetry ingestion settings: an MQTT broker, a JSON lines replay file, or the sample data if neither is set
+TELEMETRY_MQTT_HOST = os.environ.get("TELEMETRY_MQTT_HOST", "")
+TELEMETRY_MQTT_PORT = int(os.environ.get("TELEMETRY_MQTT_PORT", "1883"))
+TELEMETRY_MQTT_TOPIC = os.environ.get("TELEMETRY_MQTT_TOPIC", "vehicles/+/telemetry")
+TELEMETRY_REPLAY_FILE = os.environ.get("TELEMETRY_REPLAY_FILE", "")
+TELEMETRY_REPLAY_SPEED = float(os.environ.get("TELEMETRY_REPLAY_SPEED", "0"))  # 0 loads the file at once
+TELEMETRY_HISTORY_SECONDS = float(os.environ.get("TELEMETRY_HISTORY_SECONDS", "600"))
+TELEMETRY_HISTORY_SAMPLES = int(os.environ.get("TELEMETRY_HISTORY_SAMPLES", "120"))
+
+# Timezone used to display telemetry timestamps
+TELEMETRY_DISPLAY_TIMEZONE = os.environ.get("TELEMETRY_DISPLAY_TIMEZONE", "Australia/Sydney")
+
+# Formatted timestamp labels kept for reuse across batches, reruns and sessions
+TIMESTAMP_LABEL_CACHE_MAX_ENTRIES = 65536
+
+# Largest page of vehicles the telemetry query tool returns to the agent
+TELEMETRY_QUERY_MAX_LIMIT = int(os.environ.get("TELEMETRY_QUERY_MAX_LIMIT", "100"))
+
+# Vehicle Telemetry tab table settings
+TELEMETRY_REFRESH_SECONDS = int(os.environ.get("TELEMETRY_REFRESH_SECONDS", "5"))
+FLEET_PAGE_SIZES = [25, 50, 100, 250]
+FLEET_SORT_COLUMNS = {'Vehicle name': 'vehicle_name', 'Last updated': 'last_updated_ms'}
+FLEET_SORT_COLUMNS.update({m.capitalize() if len(m) > 1 else m.upper(): m for m in TELEMETRY_MEASUREMENTS})
+
+# Fleet analytics settings
+TELEMETRY_ANALYTICS_MEASUREMENTS = ('temperature', 'humidity', 'light', 'altitude', 'pitch', 'roll')
+TELEMETRY_ANOMALY_Z_THRESHOLD = float(os.environ.get("TELEMETRY_ANOMALY_Z_THRESHOLD", "3.0"))
+TELEMETRY_TILT_THRESHOLD_DEGREES = float(os.environ.get("TELEMETRY_TILT_THRESHOLD_DEGREES", "15.0"))
+
+# Sample telemetry used when no ingestion source is configured
+SAMPLE_TELEMETRY = [
+    {
+        'vehicle_name': 'Vehicle_001',
+        'last_updated': '2024-12-19T10:30:00Z',
+        'measurements': {
+            'temperature': 23.5,
+            'humidity': 65.2,
+            'light': 850,
+            'latitude': -33.8688,
+            'longitude': 151.2093,
+            'altitude': 58.0,
+            'pitch': 2.1,
+            'roll': -0.8,
+            'x': 0.02,
+            'y': -0.15,
+            'z': 9.81
+        }
+    },
+    {
+        'vehicle_name': 'Vehicle_002',
+        'last_updated': '2024-12-19T10:29:45Z',
+        'measurements': {
+            'temperature': 21.8,
+            'humidity': 58.7,
+            'light': 920,
+            'latitude': -33.8650,
+            'longitude': 151.2094,
+            'altitude': 62.5,
+            'pitch': 1.5,
+            'roll': 0.3,
+            'x': -0.01,
+            'y': 0.08,
+            'z': 9.79
+        }
+    }
+]
+
+
+# Marks timestamps that have never been written, e.g. empty history slots
+TIMESTAMP_UNSET = np.iinfo(np.int64).min
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Fractional seconds beyond microseconds (e.g. nanoseconds), which datetime can't represent
+_EXTRA_FRACTIONAL_DIGITS = re.compile(r'(\.\d{6})\d+')
+
+
+def normalize_timestamp(value) -> int:
+    """Convert a telemetry timestamp to UTC epoch milliseconds.
+
+    Args:
+        value: An ISO 8601 string (naive times are treated as UTC), a datetime, epoch seconds
+            or epoch milliseconds as a number or numeric string, or None for the current time
+
+    Returns:
+        The timestamp in epoch milliseconds
+
+    Raises:
+        ValueError: If the value is not a recognized timestamp
+    """
+    if value is None:
+        return time.time_ns() // 1_000_000
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            value = float(text)
+        except ValueError:
+            if text.endswith(('Z', 'z')):
+                text = text[:-1] + '+00:00'
+            try:
+                value = datetime.fromisoformat(_EXTRA_FRACTIONAL_DIGITS.sub(r'\1', text))
+            except ValueError:
+                raise ValueError(f"Unrecognized timestamp: {value!r}") from None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (value - _EPOCH) // timedelta(milliseconds=1)
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool) and np.isfinite(value):
+        # Epoch seconds stay below 1e11 until the year 5138
+        return int(value) if abs(value) >= 1e11 else int(round(value * 1000))
+    raise ValueError(f"Unrecognized timestamp: {value!r}")
+
+
+def format_iso_timestamp(epoch_ms: int) -> str:
+    """Format epoch milliseconds as an ISO 8601 UTC string, e.g. 2024-12-19T10:30:00Z."""
+    return (_EPOCH + timedelta(milliseconds=int(epoch_ms))).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@st.cache_resource
+def get_display_timezone(timezone_name: str) -> ZoneInfo:
+    """Return the zone object for a timezone name, loaded once per process."""
+    return ZoneInfo(timezone_name)
+
+
+@st.cache_resource
+def get_timestamp_label_cache() -> TTLCache:
+    """Return the formatted timestamp labels shared by every session, keyed by second and timezone."""
+    # A label never changes; the time to live only drops labels that are no longer shown
+    cache = TTLCache(max_entries=TIMESTAMP_LABEL_CACHE_MAX_ENTRIES, ttl_seconds=TELEMETRY_HISTORY_SECONDS)
+    get_metrics().add_collector(lambda: cache_gauges("timestamp_labels", cache))
+    return cache
+
+
+def _format_timestamp_label(epoch_seconds: int, timezone_name: str, cache: TTLCache) -> str:
+    key = (epoch_seconds, timezone_name)
+    label = cache.get(key)
+    if label is None:
+        local_time = datetime.fromtimestamp(epoch_seconds, tz=get_display_timezone(timezone_name))
+        place = timezone_name.rsplit('/', 1)[-1].replace('_', ' ')
+        label = local_time.strftime(f"%B %d, %Y at %I:%M:%S %p ({place} time)")
+        cache.put(key, label)
+    return label
+
+
+def format_timestamp_labels(epoch_ms, timezone_name: str = TELEMETRY_DISPLAY_TIMEZONE) -> list:
+    """Format epoch milliseconds as friendly local-time labels for display.
+
+    Each distinct second is converted and formatted once per batch, and the labels are
+    memoized across batches, so vehicles that report at the same time share the work.
+
+    Args:
+        epoch_ms: A sequence or array of epoch milliseconds
+        timezone_name: The IANA timezone to display, e.g. 'Australia/Sydney'
+
+    Returns:
+        A list of labels like 'December 19, 2024 at 09:30:00 PM (Sydney time)'
+    """
+    epoch_ms = np.asarray(epoch_ms, dtype=np.int64)
+    if len(epoch_ms) == 0:
+        return []
+    unique_seconds, inverse = np.unique(epoch_ms // 1000, return_inverse=True)
+    cache = get_timestamp_label_cache()
+    labels = [
+        "Unknown time" if epoch_seconds == TIMESTAMP_UNSET // 1000 else _format_timestamp_label(int(epoch_seconds), timezone_name, cache)
+        for epoch_seconds in unique_seconds
+    ]
+    return [labels[i] for i in inverse.ravel()]
+
+
+class TelemetryStore:
+    """In-memory vehicle telemetry, stored column-wise in NumPy arrays.
+
+    Every vehicle is assigned a row. For each measurement the store keeps a column of
+    latest values and a ring buffer of the last `history_samples` readings, so reading
+    one vehicle is O(1) and fleet-wide reads are array slices. `version` increases on
+    every ingest and can be used as a cache key for anything derived from a snapshot.
+    Running sums over each ring buffer are updated on ingest, so rolling statistics for
+    the whole fleet are O(vehicles) rather than O(vehicles x history).
+    """
+
+    def __init__(self, history_samples: int = TELEMETRY_HISTORY_SAMPLES, history_seconds: float = TELEMETRY_HISTORY_SECONDS, initial_capacity: int = 64):
+        self.history_samples = history_samples
+        self.history_seconds = history_seconds
+        self.version = 0
+        self._lock = threading.RLock()
+        self._index = {}
+        self._names = []
+        self._capacity = initial_capacity
+        self._latest = {m: np.full(initial_capacity, np.nan) for m in TELEMETRY_MEASUREMENTS}
+        self._last_updated = np.full(initial_capacity, TIMESTAMP_UNSET, dtype=np.int64)
+        self._history = {m: np.full((initial_capacity, history_samples), np.nan) for m in TELEMETRY_MEASUREMENTS}
+        self._history_timestamps = np.full((initial_capacity, history_samples), TIMESTAMP_UNSET, dtype=np.int64)
+        self._history_position = np.zeros(initial_capacity, dtype=np.int64)
+        self._history_sum = {m: np.zeros(initial_capacity) for m in TELEMETRY_MEASUREMENTS}
+        self._history_sum_squares = {m: np.zeros(initial_capacity) for m in TELEMETRY_MEASUREMENTS}
+        self._history_count = {m: np.zeros(initial_capacity, dtype=np.int64) for m in TELEMETRY_MEASUREMENTS}
+        self._snapshot_cache = (None, None)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _grow(self):
+        new_capacity = self._capacity * 2
+
+        def grow(array, fill=np.nan):
+            grown = np.full((new_capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:self._capacity] = array
+            return grown
+
+        self._latest = {m: grow(a) for m, a in self._latest.items()}
+        self._last_updated = grow(self._last_updated, TIMESTAMP_UNSET)
+        self._history = {m: grow(a) for m, a in self._history.items()}
+        self._history_timestamps = grow(self._history_timestamps, TIMESTAMP_UNSET)
+        self._history_position = grow(self._history_position, 0)
+        self._history_sum = {m: grow(a, 0) for m, a in self._history_sum.items()}
+        self._history_sum_squares = {m: grow(a, 0) for m, a in self._history_sum_squares.items()}
+        self._history_count = {m: grow(a, 0) for m, a in self._history_count.items()}
+        self._capacity = new_capacity
+
+    def _row(self, vehicle_name: str) -> int:
+        row = self._index.get(vehicle_name)
+        if row is None:
+            if len(self._names) == self._capacity:
+                self._grow()
+            row = len(self._names)
+            self._index[vehicle_name] = row
+            self._names.append(vehicle_name)
+        return row
+
+    def ingest(self, vehicle_name: str, timestamp_ms: int, measurements: dict):
+        """Record one telemetry reading for a vehicle.
+
+        Args:
+            vehicle_name: The vehicle's name
+            timestamp_ms: When the reading was taken, in epoch milliseconds
+            measurements: Measurement name to value, unknown measurements are ignored
+        """
+        with self._lock:
+            row = self._row(vehicle_name)
+            slot = self._history_position[row] % self.history_samples
+            for measurement in TELEMETRY_MEASUREMENTS:
+                value = measurements.get(measurement)
+                value = np.nan if value is None else float(value)
+                self._latest[measurement][row] = value
+                # Keep the ring buffer's running sums in step with the slot being overwritten
+                previous = self._history[measurement][row, slot]
+                if not np.isnan(previous):
+                    self._history_sum[measurement][row] -= previous
+                    self._history_sum_squares[measurement][row] -= previous * previous
+                    self._history_count[measurement][row] -= 1
+                if not np.isnan(value):
+                    self._history_sum[measurement][row] += value
+                    self._history_sum_squares[measurement][row] += value * value
+                    self._history_count[measurement][row] += 1
+                self._history[measurement][row, slot] = value
+            self._last_updated[row] = timestamp_ms
+            self._history_timestamps[row, slot] = timestamp_ms
+            self._history_position[row] += 1
+            self.version += 1
+
+    def ingest_record(self, record: dict) -> int:
+        """Record a reading in the get_vehicle_telemetry format (vehicle_name, last_updated, measurements).
+
+        The timestamp is normalized to epoch milliseconds here, once, so nothing downstream
+        has to parse it again. A missing timestamp means the reading was taken now.
+
+        Returns:
+            The reading's timestamp in epoch milliseconds
+
+        Raises:
+            ValueError: If last_updated is not a recognized timestamp
+        """
+        timestamp_ms = normalize_timestamp(record.get('last_updated'))
+        self.ingest(record['vehicle_name'], timestamp_ms, record.get('measurements', {}))
+        return timestamp_ms
+
+    def vehicle_names(self) -> list:
+        with self._lock:
+            return list(self._names)
+
+    def latest(self, vehicle_name: str) -> dict:
+        """Return the latest reading for one vehicle, or None if it is unknown."""
+        with self._lock:
+            row = self._index.get(vehicle_name)
+            if row is None:
+                return None
+            return self._record(row)
+
+    def _record(self, row: int) -> dict:
+        measurements = {}
+        for measurement in TELEMETRY_MEASUREMENTS:
+            value = self._latest[measurement][row]
+            # Measurements the vehicle did not report are left out
+            if not np.isnan(value):
+                measurements[measurement] = float(value)
+        return {
+            'vehicle_name': self._names[row],
+            'last_updated': format_iso_timestamp(self._last_updated[row]),
+            'measurements': measurements
+        }
+
+    def columns(self) -> tuple:
+        """Return copies of the latest-value columns for the whole fleet.
+
+        Returns:
+            A tuple of (vehicle names, last updated epoch milliseconds, {measurement: values})
+        """
+        with self._lock:
+            count = len(self._names)
+            return (
+                list(self._names),
+                self._last_updated[:count].copy(),
+                {m: a[:count].copy() for m, a in self._latest.items()}
+            )
+
+    def history(self, vehicle_name: str, measurement: str, seconds: float = None) -> tuple:
+        """Return a vehicle's readings for a measurement within the history window, oldest first.
+
+        Args:
+            vehicle_name: The vehicle's name
+            measurement: One of TELEMETRY_MEASUREMENTS
+            seconds: How far back to look (default: the store's history_seconds)
+
+        Returns:
+            A tuple of (epoch milliseconds, values) arrays
+        """
+        seconds = self.history_seconds if seconds is None else seconds
+        with self._lock:
+            row = self._index.get(vehicle_name)
+            if row is None:
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            # Rotate the ring buffer so the oldest slot comes first
+            shift = -(self._history_position[row] % self.history_samples)
+            timestamps = np.roll(self._history_timestamps[row], shift)
+            values = np.roll(self._history[measurement][row], shift)
+        keep = timestamps != TIMESTAMP_UNSET
+        keep &= timestamps >= timestamps.max() - int(seconds * 1000)
+        return timestamps[keep], values[keep]
+
+    def rolling_stats(self, measurements: tuple = TELEMETRY_MEASUREMENTS, seconds: float = None) -> dict:
+        """Compute per-vehicle rolling statistics for the whole fleet.
+
+        Without `seconds` the window is each vehicle's ring buffer (the last history_samples
+        readings) and the statistics come straight from the running sums. With `seconds` the
+        window is that long, relative to each vehicle's latest reading, and the history is scanned.
+
+        Args:
+            measurements: The measurements to compute statistics for
+            seconds: Optional window length in seconds
+
+        Returns:
+            Measurement name to a dict of 'mean', 'std' and 'count' arrays, one value per vehicle
+        """
+        stats = {}
+        with self._lock, np.errstate(invalid='ignore', divide='ignore'):
+            count = len(self._names)
+            if seconds is None:
+                for measurement in measurements:
+                    samples = self._history_count[measurement][:count].copy()
+                    mean = self._history_sum[measurement][:count] / samples
+                    variance = self._history_sum_squares[measurement][:count] / samples - mean * mean
+                    stats[measurement] = {'mean': mean, 'std': np.sqrt(np.maximum(variance, 0.0)), 'count': samples}
+                return stats
+
+            in_window = self._history_timestamps[:count] >= (self._last_updated[:count] - int(seconds * 1000))[:, None]
+            for measurement in measurements:
+                values = self._history[measurement][:count]
+                valid = in_window & ~np.isnan(values)
+                values = np.where(valid, values, 0.0)
+                samples = valid.sum(axis=1)
+                mean = values.sum(axis=1) / samples
+                variance = np.einsum('ij,ij->i', values, values) / samples - mean * mean
+                stats[measurement] = {'mean': mean, 'std': np.sqrt(np.maximum(variance, 0.0)), 'count': samples}
+        return stats
+
+    def analytics_snapshot(self, measurements: tuple = TELEMETRY_MEASUREMENTS, seconds: float = None) -> tuple:
+        """Return the latest-value columns and rolling statistics from one consistent snapshot.
+
+        Args:
+            measurements: The measurements to compute rolling statistics for
+            seconds: Optional rolling window length in seconds
+
+        Returns:
+            A tuple of (version, vehicle names, last updated epoch milliseconds,
+            {measurement: values}, rolling statistics), all taken under the store's lock
+        """
+        with self._lock:
+            names, last_updated, columns = self.columns()
+            return self.version, names, last_updated, columns, self.rolling_stats(measurements, seconds)
+
+    def snapshot(self) -> list:
+        """Return the latest reading for every vehicle, rebuilt only when new data has arrived."""
+        with self._lock:
+            version, rows = self._snapshot_cache
+            if version != self.version:
+                rows = [self._record(row) for row in range(len(self._names))]
+                self._snapshot_cache = (self.version, rows)
+            return rows
+
+
+def replay_telemetry_file(store: TelemetryStore, path: str, speed: float = TELEMETRY_REPLAY_SPEED):
+    """Ingest a JSON lines file of telemetry records.
+
+    Args:
+        store: The store to ingest into
+        path: Path to a file with one get_vehicle_telemetry style record per line
+        speed: Replay speed relative to the recorded timestamps, 0 ingests everything at once
+    """
+    previous_timestamp = None
+    with open(path) as replay_file:
+        for line in replay_file:
+            if not line.strip():
+                continue
+            try:
+                timestamp = store.ingest_record(json.loads(line))
+            except ValueError as e:
+                logger.warning("Skipping telemetry record", extra={'path': path, 'error': str(e)})
+                continue
+            if speed > 0:
+                if previous_timestamp is not None and timestamp > previous_timestamp:
+                    time.sleep((timestamp - previous_timestamp) / 1000 / speed)
+                previous_timestamp = timestamp
+
+
+def subscribe_telemetry_mqtt(store: TelemetryStore, host: str = TELEMETRY_MQTT_HOST, port: int = TELEMETRY_MQTT_PORT, topic: str = TELEMETRY_MQTT_TOPIC):
+    """Subscribe to vehicle telemetry on an MQTT broker and ingest it into the store.
+
+    Messages are get_vehicle_telemetry style records; if 'vehicle_name' is missing the
+    second topic level is used (e.g. vehicles/Vehicle_001/telemetry). Requires paho-mqtt.
+
+    Returns:
+        The connected MQTT client, with its network loop running on a background thread
+    """
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError as e:
+        raise ImportError("paho-mqtt is required for MQTT telemetry ingestion: pip install paho-mqtt") from e
+
+    def on_connect(client, userdata, *args):
+        # Subscribe on every (re)connect
+        client.subscribe(topic, qos=0)
+
+    def on_message(client, userdata, message):
+        try:
+            record = json.loads(message.payload)
+            if 'vehicle_name' not in record:
+                levels = message.topic.split('/')
+                record['vehicle_name'] = levels[1] if len(levels) > 1 else message.topic
+            store.ingest_record(record)
+        except Exception as e:
+            logger.warning("Error ingesting telemetry", extra={'topic': message.topic, 'error': str(e)})
+
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    else:
+        client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect_async(host, port)
+    client.loop_start()
+    return client
+
+
+@st.cache_resource
+def get_telemetry_store() -> TelemetryStore:
+    """Return the process-wide telemetry store, starting ingestion on first use."""
+    store = TelemetryStore()
+    if TELEMETRY_MQTT_HOST:
+        subscribe_telemetry_mqtt(store)
+    if TELEMETRY_REPLAY_FILE:
+        threading.Thread(
+            target=replay_telemetry_file,
+            args=(store, TELEMETRY_REPLAY_FILE),
+            name="telemetry-replay",
+            daemon=True
+        ).start()
+    if not TELEMETRY_MQTT_HOST and not TELEMETRY_REPLAY_FILE:
+        for record in SAMPLE_TELEMETRY:
+            store.ingest_record(record)
+    return store
+
+
+def instrumented_tool(func):
+    """Mark a function as an agent tool and instrument it.
+
+    Every call, from the agent or the UI, records its latency and status in the metrics
+    registry and is logged. The function is otherwise left as it is; it is wrapped with
+    strands.tool by get_strands_tools() when an agent is built, which keeps the Strands
+    import and tool spec generation off the first page load.
+    """
+    metrics = get_metrics()
+    name = func.__name__
+
+    def record(start, result, failed):
+        # Tools report handled failures as {'status': 'error', ...}
+        status = "error" if failed or (isinstance(result, dict) and result.get('status') == 'error') else "ok"
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics.observe("tool_latency_ms", duration_ms, tool=name)
+        metrics.inc("tool_calls_total", tool=name, status=status)
+        logger.info("Tool call", extra={'event': 'tool_call', 'tool': name, 'status': status, 'duration_ms': round(duration_ms, 2)})
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result, failed = None, True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record(start, result, failed)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result, failed = None, True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record(start, result, failed)
+
+    return wrapper
+
+
+# Agent tool execution settings: 'concurrent' runs the tool calls of one model response at
+# the same time, 'sequential' one after another. Device commands are published in order per
+# device by the command outbox either way.
+AGENT_TOOL_EXECUTION = os.environ.get("AGENT_TOOL_EXECUTION", "concurrent")
+
+# Default time an agent tool call may take before the agent is told its outcome is unknown
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT_SECONDS", "10"))
+
+# Threads running blocking tool calls for every session's agent
+TOOL_WORKERS = int(os.environ.get("TOOL_WORKERS", "16"))
+
+
+def tool_execution(timeout_seconds: float = TOOL_TIMEOUT_SECONDS):
+    """Declare how the agent runs a tool; apply below @instrumented_tool.
+
+    Args:
+        timeout_seconds: How long a call may take, or None for no limit
+    """
+    def decorator(func):
+        func.timeout_seconds = timeout_seconds
+        return func
+
+    return decorator
+
+
+@st.cache_resource
+def get_tool_pool() -> ThreadPoolExecutor:
+    """Return the process-wide thread pool blocking tool calls run on."""
+    return ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="agent-tool")
+
+
+def make_async_tool(func):
+    """Return an async version of a tool for the agent, applying its tool_execution settings.
+
+    Blocking tools run on a shared thread pool, so the event loop stays free to run other
+    tool calls. Device tools only queue their command on the command outbox, which keeps
+    each device's commands in order, so they need no executor of their own.
+
+    A call that exceeds its timeout can't be stopped and may still take effect, so the
+    agent is told it is pending with an unknown outcome rather than that it failed. The
+    pool is not the event loop's default executor, which asyncio.run() waits for when the
+    turn's loop closes, so an abandoned call doesn't hold up the rest of the turn.
+
+    Args:
+        func: A function marked with @instrumented_tool
+
+    Returns:
+        A coroutine function with the same name, signature and docstring
+    """
+    timeout_seconds = getattr(func, 'timeout_seconds', TOOL_TIMEOUT_SECONDS)
+    metrics = get_metrics()
+
+    @functools.wraps(func)
+    async def async_tool(*args, **kwargs):
+        if inspect.iscoroutinefunction(func):
+            call = func(*args, **kwargs)
+        else:
+            call = asyncio.wrap_future(get_tool_pool().submit(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(call, timeout_seconds)
+        except asyncio.TimeoutError:
+            metrics.inc("tool_timeouts_total", tool=func.__name__)
+            return {
+                'status': 'pending',
+                'message': f"{func.__name__} did not finish within {timeout_seconds} seconds and is still running, its outcome is unknown"
+            }
+
+    return async_tool
+
+
+# Cache settings: chat answers that only read data are reused for RESPONSE_CACHE_TTL_SECONDS,
+# read-only tool results for TOOL_RESULT_CACHE_TTL_SECONDS
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+TOOL_RESULT_CACHE_TTL_SECONDS = float(os.environ.get("TOOL_RESULT_CACHE_TTL_SECONDS", "5"))
+TOOL_RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_RESULT_CACHE_MAX_ENTRIES", "256"))
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries expire after a fixed time to live.
+
+    Each entry records what it cost to produce (milliseconds and model tokens), so hits
+    can report the latency and tokens they saved.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self.saved_tokens = 0
+
+    def get(self, key):
+        """Return the cached value for a key, or None if it is missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            _, value, cost_ms, tokens = entry
+            self.hits += 1
+            self.saved_ms += cost_ms
+            self.saved_tokens += tokens
+            return value
+
+    def put(self, key, value, cost_ms: float = 0.0, tokens: int = 0):
+        """Cache a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, cost_ms, tokens)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Return the hit rate and the latency and tokens saved by hits."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'saved_ms': round(self.saved_ms, 1),
+                'saved_tokens': self.saved_tokens
+            }
+
+
+def cache_gauges(cache_name: str, cache: TTLCache) -> list:
+    """Return a cache's hit, miss and savings counts as metrics samples."""
+    stats = cache.stats()
+    return [
+        (f"cache_{field}", {'cache': cache_name}, stats[field])
+        for field in ('entries', 'hits', 'misses', 'saved_ms', 'saved_tokens')
+    ]
+
+
+@st.cache_resource
+def get_tool_result_cache() -> TTLCache:
+    """Return the process-wide cache of read-only tool results."""
+    cache = TTLCache(TOOL_RESULT_CACHE_MAX_ENTRIES, TOOL_RESULT_CACHE_TTL_SECONDS)
+    get_metrics().add_collector(lambda: cache_gauges("tool_results", cache))
+    return cache
+
+
+# Names of tools that only read data; only these are memoized, and only chat turns that
+# use nothing else are eligible for the response cache
+READ_ONLY_TOOLS = set()
+
+
+def read_only_tool(func):
+    """Mark a telemetry tool as side-effect free and memoize its results briefly.
+
+    Results are keyed by the arguments and the telemetry store version, so new telemetry
+    is never hidden behind the cache. Apply below @instrumented_tool. Never use this on tools that
+    publish commands.
+    """
+    READ_ONLY_TOOLS.add(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, get_telemetry_store().version, json.dumps([args, kwargs], sort_keys=True, default=str))
+        cache = get_tool_result_cache()
+        result = cache.get(key)
+        if result is None:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            cache.put(key, result, cost_ms=(time.perf_counter() - start) * 1000)
+        return result
+
+    return wrapper
+
 
-@tool
+@instrumented_tool
+@read_only_tool
 def get_vehicle_telemetry() -> list:
     """
-    Retrieves all vehicle telemetry data.
+    Retrieves all vehicle telemetry data. For large fleets use query_vehicle_telemetry
+    or summarize_vehicle_telemetry to get only the vehicles and measurements needed.
     
     Returns:
         list: A list of all vehicles and its telemetries
     
-    NOTE: This function returns static sample data. To integrate with your own vehicle API:
-    1. Replace the static data below with a call to your vehicle telemetry API
-    2. Ensure your API returns data with these properties: temperature, humidity, light, 
-       latitude, longitude, altitude, pitch, roll, x, y, z
-    3. Structure the response as a list of vehicles with measurements
-    """
-    # TODO: Replace this static data with your own vehicle telemetry API call
-    # Example: response = requests.get('https://your-api.com/vehicles/telemetry')
+    NOTE: The data comes from the in-memory telemetry store, fed by the MQTT broker or
+    replay file configured with the TELEMETRY_* environment variables, or the sample
+    data if neither is set. Records contain these measurements: temperature, humidity,
+    light, latitude, longitude, altitude, pitch, roll, x, y, z
+    """
+    telemetry_data = get_telemetry_store().snapshot()
+    
+    # Log a sample of vehicles at debug level, the whole fleet can be thousands of vehicles
+    if logger.isEnabledFor(logging.DEBUG):
+        for vehicle in random.sample(telemetry_data, min(LOG_VEHICLE_SAMPLE_SIZE, len(telemetry_data))):
+            measurements = vehicle.get('measurements', {})
+            logger.debug("Vehicle telemetry sample", extra={
+                'vehicle_name': vehicle.get('vehicle_name', 'Unknown'),
+                'temperature': measurements.get('temperature'),
+                'humidity': measurements.get('humidity'),
+                'fleet_size': len(telemetry_data)
+            })
     
-    static_data = [
-        {
-            'vehicle_name': 'Vehicle_001',
-            'last_updated': '2024-12-19T10:30:00Z',
-            'measurements': {
-                'temperature': 23.5,
-                'humidity': 65.2,
-                'light': 850,
-                'latitude': -33.8688,
-                'longitude': 151.2093,
-                'altitude': 58.0,
-                'pitch': 2.1,
-                'roll': -0.8,
-                'x': 0.02,
-                'y': -0.15,
-                'z': 9.81
+    return telemetry_data
+
+def filter_telemetry(store: TelemetryStore, vehicle_names: list = None, min_latitude: float = None, max_latitude: float = None,
+                     min_longitude: float = None, max_longitude: float = None, min_values: dict = None, max_values: dict = None) -> tuple:
+    """Select vehicles from the store's latest readings with vectorized filters.
+
+    Args:
+        store: The telemetry store
+        vehicle_names: Keep vehicles whose name contains any of these (case-insensitive)
+        min_latitude, max_latitude, min_longitude, max_longitude: Bounding box on position
+        min_values: Measurement name to inclusive lower bound, e.g. {"temperature": 30}
+        max_values: Measurement name to inclusive upper bound
+
+    Returns:
+        A tuple of (vehicle names, last updated epoch milliseconds, {measurement: values}, indices of the matching vehicles)
+
+    Raises:
+        ValueError: If a threshold names an unknown measurement or is not a number
+    """
+    names, last_updated, columns = store.columns()
+    mask = np.ones(len(names), dtype=bool)
+
+    if vehicle_names:
+        lower_names = np.array([name.lower() for name in names], dtype=str)
+        name_mask = np.zeros(len(names), dtype=bool)
+        for pattern in vehicle_names:
+            name_mask |= np.char.find(lower_names, pattern.lower()) >= 0
+        mask &= name_mask
+
+    bounds = [
+        ('latitude', min_latitude, max_latitude),
+        ('longitude', min_longitude, max_longitude)
+    ]
+    bounds += [(m, v, None) for m, v in (min_values or {}).items()]
+    bounds += [(m, None, v) for m, v in (max_values or {}).items()]
+    for measurement, lower, upper in bounds:
+        if measurement not in columns:
+            raise ValueError(f"Unknown measurement: {measurement}. Must be one of: {', '.join(TELEMETRY_MEASUREMENTS)}")
+        try:
+            lower = None if lower is None else float(lower)
+            upper = None if upper is None else float(upper)
+        except (TypeError, ValueError):
+            raise ValueError(f"Thresholds for {measurement} must be numbers, got {lower!r} and {upper!r}") from None
+        # Comparisons with NaN are False, so vehicles missing the measurement are excluded
+        if lower is not None:
+            mask &= columns[measurement] >= lower
+        if upper is not None:
+            mask &= columns[measurement] <= upper
+
+    return names, last_updated, columns, np.flatnonzero(mask)
+
+
+@instrumented_tool
+@read_only_tool
+def query_vehicle_telemetry(vehicle_names: list = None, measurements: list = None, min_latitude: float = None, max_latitude: float = None,
+                            min_longitude: float = None, max_longitude: float = None, min_values: dict = None, max_values: dict = None,
+                            limit: int = 20, offset: int = 0) -> dict:
+    """Find vehicles by name, position or measurement thresholds and return a page of their latest telemetry.
+    Prefer this over get_vehicle_telemetry, which returns the whole fleet.
+
+    Args:
+        vehicle_names: Only vehicles whose name contains one of these strings, e.g. ["Vehicle_001"]
+        measurements: Only return these measurements, any of: temperature, humidity, light, latitude, longitude, altitude, pitch, roll, x, y, z (default: all)
+        min_latitude: Southern edge of a bounding box
+        max_latitude: Northern edge of a bounding box
+        min_longitude: Western edge of a bounding box
+        max_longitude: Eastern edge of a bounding box
+        min_values: Minimum value per measurement, e.g. {"temperature": 30} for vehicles at 30°C or hotter
+        max_values: Maximum value per measurement, e.g. {"humidity": 40}
+        limit: Maximum number of vehicles to return (default: 20, at most 100)
+        offset: Number of matching vehicles to skip, for paging through results
+
+    Returns:
+        A dictionary with the total number of matches and the requested page of vehicles
+    """
+    try:
+        names, last_updated, columns, indices = filter_telemetry(
+            get_telemetry_store(), vehicle_names, min_latitude, max_latitude,
+            min_longitude, max_longitude, min_values, max_values
+        )
+        projection = list(measurements or TELEMETRY_MEASUREMENTS)
+        unknown = [m for m in projection if m not in columns]
+        if unknown:
+            raise ValueError(f"Unknown measurement: {', '.join(unknown)}. Must be one of: {', '.join(TELEMETRY_MEASUREMENTS)}")
+
+        limit = max(0, min(int(limit), TELEMETRY_QUERY_MAX_LIMIT))
+        offset = max(0, int(offset))
+        page = indices[offset:offset + limit]
+        vehicles = []
+        for row in page:
+            vehicles.append({
+                'vehicle_name': names[row],
+                'last_updated': format_iso_timestamp(last_updated[row]),
+                'measurements': {m: float(columns[m][row]) for m in projection if not np.isnan(columns[m][row])}
+            })
+
+        return {
+            'status': 'success',
+            'total_matches': int(len(indices)),
+            'offset': offset,
+            'returned': len(vehicles),
+            'vehicles': vehicles
+        }
+    except ValueError as e:
+        return {'status': 'error', 'error': str(e)}
+
+@instrumented_tool
+@read_only_tool
+def summarize_vehicle_telemetry(vehicle_names: list = None, measurements: list = None, min_latitude: float = None, max_latitude: float = None,
+                                min_longitude: float = None, max_longitude: float = None, min_values: dict = None, max_values: dict = None) -> dict:
+    """Summarize the latest telemetry across matching vehicles as min/mean/max per measurement instead of raw rows.
+    Use this for fleet-wide questions such as average temperature or how many vehicles are in an area.
+
+    Args:
+        vehicle_names: Only vehicles whose name contains one of these strings
+        measurements: Only summarize these measurements, any of: temperature, humidity, light, latitude, longitude, altitude, pitch, roll, x, y, z (default: all)
+        min_latitude: Southern edge of a bounding box
+        max_latitude: Northern edge of a bounding box
+        min_longitude: Western edge of a bounding box
+        max_longitude: Eastern edge of a bounding box
+        min_values: Minimum value per measurement, e.g. {"temperature": 30}
+        max_values: Maximum value per measurement, e.g. {"humidity": 40}
+
+    Returns:
+        A dictionary with the number of matching vehicles and min/mean/max/count per measurement
+    """
+    try:
+        names, last_updated, columns, indices = filter_telemetry(
+            get_telemetry_store(), vehicle_names, min_latitude, max_latitude,
+            min_longitude, max_longitude, min_values, max_values
+        )
+        projection = list(measurements or TELEMETRY_MEASUREMENTS)
+        unknown = [m for m in projection if m not in columns]
+        if unknown:
+            raise ValueError(f"Unknown measurement: {', '.join(unknown)}. Must be one of: {', '.join(TELEMETRY_MEASUREMENTS)}")
+
+        summary = {}
+        for measurement in projection:
+            values = columns[measurement][indices]
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            summary[measurement] = {
+                'min': round(float(values.min()), 4),
+                'mean': round(float(values.mean()), 4),
+                'max': round(float(values.max()), 4),
+                'count': int(len(values))
             }
-        },
-        {
-            'vehicle_name': 'Vehicle_002',
-            'last_updated': '2024-12-19T10:29:45Z',
-            'measurements': {
-                'temperature': 21.8,
-                'humidity': 58.7,
-                'light': 920,
-                'latitude': -33.8650,
-                'longitude': 151.2094,
-                'altitude': 62.5,
-                'pitch': 1.5,
-                'roll': 0.3,
-                'x': -0.01,
-                'y': 0.08,
-                'z': 9.79
+
+        return {
+            'status': 'success',
+            'total_matches': int(len(indices)),
+            'summary': summary
+        }
+    except ValueError as e:
+        return {'status': 'error', 'error': str(e)}
+
+@st.cache_resource
+def get_fleet_analytics_cache() -> TTLCache:
+    """Return the fleet analytics cache shared by every session, keyed by store version and window."""
+    cache = TTLCache(max_entries=4, ttl_seconds=TELEMETRY_HISTORY_SECONDS)
+    get_metrics().add_collector(lambda: cache_gauges("fleet_analytics", cache))
+    return cache
+
+
+
+def compute_fleet_analytics(store: TelemetryStore, window_seconds: float = None) -> dict:
+    """Compute derived telemetry for every vehicle at once with NumPy.
+
+    Results are cached per store version and window, so repeated requests against the
+    same telemetry snapshot are free until new data is ingested.
+
+    Args:
+        store: The telemetry store
+        window_seconds: Rolling statistics window in seconds (default: each vehicle's ring buffer)
+
+    Returns:
+        A dict of per-vehicle arrays: 'names', 'tilt' (degrees from level, from pitch and roll),
+        'acceleration' (magnitude of x/y/z), and per measurement in TELEMETRY_ANALYTICS_MEASUREMENTS
+        the 'rolling' stats, 'fleet_z' (latest value against the fleet) and 'trend_z' (latest
+        value against the vehicle's own rolling window); plus 'version' and 'computed_ms'
+    """
+    cache = get_fleet_analytics_cache()
+    cached = cache.get((id(store), store.version, window_seconds))
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    # The version, columns and rolling statistics come from one snapshot, so the result is
+    # cached under the version it was computed from even if data arrives meanwhile
+    version, names, last_updated, columns, rolling = store.analytics_snapshot(TELEMETRY_ANALYTICS_MEASUREMENTS, window_seconds)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pitch = np.radians(columns['pitch'])
+        roll = np.radians(columns['roll'])
+        tilt = np.degrees(np.arccos(np.clip(np.cos(pitch) * np.cos(roll), -1.0, 1.0)))
+        acceleration = np.sqrt(columns['x'] ** 2 + columns['y'] ** 2 + columns['z'] ** 2)
+
+        fleet_z = {}
+        trend_z = {}
+        for measurement in TELEMETRY_ANALYTICS_MEASUREMENTS:
+            latest = columns[measurement]
+            fleet_std = np.nanstd(latest) if len(latest) else np.nan
+            fleet_z[measurement] = (latest - np.nanmean(latest)) / fleet_std if fleet_std else np.zeros_like(latest)
+            std = rolling[measurement]['std']
+            trend_z[measurement] = np.where(std > 0, (latest - rolling[measurement]['mean']) / std, 0.0)
+
+    analytics = {
+        'names': names,
+        'tilt': tilt,
+        'acceleration': acceleration,
+        'rolling': rolling,
+        'fleet_z': fleet_z,
+        'trend_z': trend_z,
+        'version': version,
+        'computed_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+    cache.put((id(store), version, window_seconds), analytics, cost_ms=analytics['computed_ms'])
+    return analytics
+
+
+def find_fleet_anomalies(analytics: dict, z_threshold: float = TELEMETRY_ANOMALY_Z_THRESHOLD, tilt_threshold_degrees: float = TELEMETRY_TILT_THRESHOLD_DEGREES) -> list:
+    """Return the vehicles that are tilting or have an anomalous measurement, most severe first.
+
+    Args:
+        analytics: The result of compute_fleet_analytics
+        z_threshold: Flag a measurement when its fleet or trend z-score exceeds this
+        tilt_threshold_degrees: Flag a vehicle when it is tilted further than this
+
+    Returns:
+        A list of dicts with the vehicle name, tilt, acceleration and the flagged measurements
+    """
+    tilt = analytics['tilt']
+    flagged = tilt > tilt_threshold_degrees
+    severity = np.where(flagged, tilt / tilt_threshold_degrees * z_threshold, 0.0)
+    for z_scores in (analytics['fleet_z'], analytics['trend_z']):
+        for z in z_scores.values():
+            abs_z = np.nan_to_num(np.abs(z))
+            flagged |= abs_z > z_threshold
+            severity = np.maximum(severity, abs_z)
+
+    anomalies = []
+    for row in np.flatnonzero(flagged)[np.argsort(-severity[flagged], kind='stable')]:
+        measurements = {}
+        for measurement in TELEMETRY_ANALYTICS_MEASUREMENTS:
+            fleet_z = float(analytics['fleet_z'][measurement][row])
+            trend_z = float(analytics['trend_z'][measurement][row])
+            if abs(fleet_z) > z_threshold or abs(trend_z) > z_threshold:
+                measurements[measurement] = {'fleet_z': round(fleet_z, 2), 'trend_z': round(trend_z, 2)}
+        anomalies.append({
+            'vehicle_name': analytics['names'][row],
+            'tilt_degrees': None if np.isnan(tilt[row]) else round(float(tilt[row]), 1),
+            'tilting': bool(tilt[row] > tilt_threshold_degrees),
+            'acceleration': None if np.isnan(analytics['acceleration'][row]) else round(float(analytics['acceleration'][row]), 3),
+            'anomalous_measurements': measurements
+        })
+    return anomalies
+
+
+@instrumented_tool
+@read_only_tool
+def analyze_fleet_telemetry(z_threshold: float = TELEMETRY_ANOMALY_Z_THRESHOLD, tilt_threshold_degrees: float = TELEMETRY_TILT_THRESHOLD_DEGREES,
+                            window_seconds: float = None, limit: int = 20) -> dict:
+    """Find vehicles that are tilting, overheating or otherwise anomalous across the whole fleet.
+    Use this for questions like "which vehicles are tilting or overheating" instead of reading raw telemetry.
+
+    Args:
+        z_threshold: How many standard deviations from the fleet, or from the vehicle's own recent readings, counts as anomalous (default: 3)
+        tilt_threshold_degrees: Vehicles tilted further than this from level are flagged (default: 15)
+        window_seconds: How many seconds of recent history to compare against (default: the most recent readings kept per vehicle)
+        limit: Maximum number of flagged vehicles to return, most severe first (default: 20)
+
+    Returns:
+        A dictionary with fleet-wide tilt and acceleration statistics and the flagged vehicles
+    """
+    analytics = compute_fleet_analytics(get_telemetry_store(), window_seconds)
+    anomalies = find_fleet_anomalies(analytics, z_threshold, tilt_threshold_degrees)
+
+    def describe(values):
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return None
+        return {'min': round(float(values.min()), 3), 'mean': round(float(values.mean()), 3), 'max': round(float(values.max()), 3)}
+
+    return {
+        'status': 'success',
+        'vehicles': len(analytics['names']),
+        'tilt_degrees': describe(analytics['tilt']),
+        'acceleration': describe(analytics['acceleration']),
+        'flagged_vehicles': len(anomalies),
+        'anomalies': anomalies[:max(0, min(limit, TELEMETRY_QUERY_MAX_LIMIT))],
+        'computed_ms': analytics['computed_ms']
+    }
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_fleet_dataframe(_store: TelemetryStore, version: int, timezone_name: str) -> pd.DataFrame:
+    """Return the latest telemetry for the whole fleet as one dataframe.
+
+    Cached on the store version and display timezone, so the table is only rebuilt when
+    new telemetry arrives.
+
+    Args:
+        _store: The telemetry store (not hashed by Streamlit)
+        version: The store version the dataframe is built for
+        timezone_name: The timezone for the 'last_updated' labels
+
+    Returns:
+        A dataframe with one row per vehicle: vehicle_name, last_updated, the measurements and last_updated_ms
+    """
+    names, last_updated, columns = _store.columns()
+    frame = pd.DataFrame({'vehicle_name': names, 'last_updated': format_timestamp_labels(last_updated, timezone_name)})
+    for measurement in TELEMETRY_MEASUREMENTS:
+        frame[measurement] = columns[measurement]
+    frame['last_updated_ms'] = last_updated
+    return frame
+
+# JSON Schema parameter types accepted in the device registry, and the Python types they take
+REGISTRY_PARAMETER_TYPES = {'string': str, 'integer': int, 'number': (int, float), 'boolean': bool}
+
+_PLACEHOLDER = re.compile(r"\{(\w*)\}")
+
+
+def compile_payload_template(payload_template: dict, parameters: dict):
+    """Compile a registry payload template into a function that renders a payload.
+
+    A string value that is exactly '{name}' is replaced with the argument itself, keeping
+    its type; other strings with placeholders are formatted; everything else is a
+    constant. The template is checked once here rather than on every publish.
+
+    Args:
+        payload_template: A flat dict of payload keys to values
+        parameters: The command's parameters, by name
+
+    Returns:
+        A function of the arguments dict returning the payload dict
+
+    Raises:
+        ValueError: If a placeholder is not one of the parameters
+    """
+    fields = []
+    for key, value in payload_template.items():
+        names = _PLACEHOLDER.findall(value) if isinstance(value, str) else []
+        unknown = [name for name in names if name not in parameters]
+        if unknown:
+            raise ValueError(f"Unknown placeholder {{{unknown[0]}}} in payload key '{key}'")
+        if names and _PLACEHOLDER.fullmatch(value):
+            fields.append((key, 'argument', names[0]))
+        elif names:
+            fields.append((key, 'format', value))
+        else:
+            fields.append((key, 'constant', value))
+
+    def render(arguments: dict) -> dict:
+        return {
+            key: arguments[ref] if kind == 'argument' else ref.format(**arguments) if kind == 'format' else ref
+            for key, kind, ref in fields
+        }
+
+    return render
+
+
+class DeviceCommand:
+    """A device command from the registry: its parameters, topic and compiled payload.
+
+    Calling as_tool() gives the agent tool for the command, with a signature, type hints
+    and docstring generated from the registry, so its tool spec is the same as a
+    hand-written @instrumented_tool function's.
+    """
+
+    def __init__(self, name: str, device: str, device_description: str, topic: str, definition: dict):
+        self.name = name
+        self.device = device
+        self.device_description = device_description
+        self.topic = topic
+        self.description = definition['description']
+        self.parameters = definition.get('parameters', {})
+        for parameter, spec in self.parameters.items():
+            if spec.get('type', 'string') not in REGISTRY_PARAMETER_TYPES:
+                raise ValueError(f"Unknown type '{spec['type']}' for parameter '{parameter}' of {name}")
+        self.render_payload = compile_payload_template(definition['payload'], self.parameters)
+        # Argument values that make the command cancel the device's pending scheduled
+        # command, e.g. a manual 'stop' makes the stop at the end of a timed feed redundant
+        self.cancels_scheduled = definition.get('cancels_scheduled', {})
+        for parameter in self.cancels_scheduled:
+            if parameter not in self.parameters:
+                raise ValueError(f"Unknown parameter '{parameter}' in cancels_scheduled of {name}")
+
+    def validate(self, arguments: dict) -> str:
+        """Check the arguments against the parameters.
+
+        Whole-number floats given for integer parameters, such as a speed of 2.0, are
+        replaced in `arguments` with the equivalent int.
+
+        Args:
+            arguments: The arguments by parameter name, defaults applied
+
+        Returns:
+            An error message, or None if the arguments are valid
+        """
+        for name, spec in self.parameters.items():
+            value = arguments.get(name)
+            expected = REGISTRY_PARAMETER_TYPES[spec.get('type', 'string')]
+            # Models often send whole numbers as floats
+            if expected is int and isinstance(value, float) and value.is_integer():
+                value = arguments[name] = int(value)
+            # bool is an int subclass, but True is not a valid speed
+            if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+                return f"Invalid {name}: {value!r}. Must be of type {spec.get('type', 'string')}"
+            if 'enum' in spec and value not in spec['enum']:
+                return f"Invalid {name}: {value}. Must be one of: {', '.join(map(str, spec['enum']))}"
+        return None
+
+    def send(self, **arguments) -> dict:
+        """Validate the arguments, render the payload and queue it on the command outbox.
+
+        Returns:
+            A dictionary with the status of the operation: 'queued' with the command ID,
+            'debounced' if it repeats the command just queued, or 'error'
+        """
+        error = self.validate(arguments)
+        if error:
+            return {'status': 'error', 'error': error}
+        payload = self.render_payload(arguments)
+        message_json = json.dumps(payload)
+        try:
+            # Skip the command if it repeats the one just queued for the device
+            if not get_command_debouncer().should_send(self.device, self.topic, message_json):
+                return {
+                    'status': 'debounced',
+                    'message': f"The same command was just queued for {self.device}, ignoring the repeat",
+                    'topic': self.topic,
+                    'payload': payload
+                }
+            queued = get_command_outbox().enqueue(self.device, self.topic, message_json)
+        except Exception as e:
+            get_command_debouncer().forget(self.device, self.topic, message_json)
+            error_result = {'status': 'error', 'error': f"Unexpected error: {str(e)}"}
+            logger.exception("Unexpected error queueing command", extra={**error_result, 'tool': self.name})
+            return error_result
+        return {
+            'status': 'queued',
+            'message': f"Command {self.name} queued for {self.device}"
+                       + (f", replacing queued command {queued['replaced_command_id']}" if queued['replaced_command_id'] else ""),
+            'topic': self.topic,
+            'payload': payload,
+            'command_id': queued['command_id'],
+            'queue_depth': queued['queue_depth']
+        }
+
+    def docstring(self) -> str:
+        """Return the tool docstring, in the Args/Returns form Strands reads parameter descriptions from."""
+        lines = [f"{self.description} {self.device_description}".strip(), "", "Args:"]
+        for name, spec in self.parameters.items():
+            line = f"    {name}: {spec.get('description', name)}"
+            if 'enum' in spec:
+                line += f", must be one of: {', '.join(repr(value) for value in spec['enum'])}"
+            if 'default' in spec:
+                line += f" (default: {spec['default']})"
+            lines.append(line)
+        lines += ["", "Returns:", "    A dictionary with the status of the operation"]
+        return "\n".join(lines)
+
+    def as_tool(self):
+        """Return the command as an instrumented agent tool function."""
+        parameters = []
+        for name, spec in self.parameters.items():
+            annotation = REGISTRY_PARAMETER_TYPES[spec.get('type', 'string')]
+            if 'enum' in spec:
+                annotation = typing.Literal[tuple(spec['enum'])]
+            elif isinstance(annotation, tuple):
+                annotation = float
+            default = spec.get('default', inspect.Parameter.empty)
+            parameters.append(inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=default, annotation=annotation))
+        signature = inspect.Signature(parameters, return_annotation=dict)
+
+        def command_tool(*args, **kwargs):
+            try:
+                bound = signature.bind(*args, **kwargs)
+            except TypeError as e:
+                return {'status': 'error', 'error': str(e)}
+            bound.apply_defaults()
+            result = self.send(**bound.arguments)
+            # Other commands leave it alone: the device is shared by every session, and one
+            # visitor's 'forward' must not stop another's timed feed from ending
+            if result['status'] == 'queued' and self.cancels_scheduled and all(
+                    bound.arguments.get(parameter) == value for parameter, value in self.cancels_scheduled.items()):
+                get_command_scheduler().cancel(self.device)
+            return result
+
+        command_tool.__name__ = command_tool.__qualname__ = self.name
+        command_tool.__doc__ = self.docstring()
+        command_tool.__signature__ = signature
+        command_tool.__annotations__ = {p.name: p.annotation for p in parameters} | {'return': dict}
+        return instrumented_tool(command_tool)
+
+
+class DeviceRegistry:
+    """The devices, commands and groups loaded from the device registry file.
+
+    The whole file is checked when it is loaded, so a bad topic, parameter or payload
+    placeholder fails at startup rather than on the first command.
+
+    Attributes:
+        topics: Topic names by registry key
+        commands: DeviceCommand objects by tool name
+        tools: The generated agent tools by name
+        groups: Fan-out groups by name, with their payload template and per-device topics
+        keywords: Words that select each generated tool or group for a prompt
+        version: A hash of the registry's contents, part of the cache keys of everything
+            built from its tools
+    """
+
+    def __init__(self, definition: dict):
+        self.version = hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()[:16]
+        self.topics = dict(definition.get('topics', {}))
+        self.commands = {}
+        self.keywords = {}
+        for device, spec in definition.get('devices', {}).items():
+            topic = self._topic(spec['topic'], device)
+            for name, command in spec.get('commands', {}).items():
+                if name in self.commands:
+                    raise ValueError(f"Command {name} is defined for both {self.commands[name].device} and {device}")
+                self.commands[name] = DeviceCommand(name, device, spec.get('description', ''), topic, command)
+                self.keywords[name] = tuple(spec.get('keywords', ()))
+        self.groups = {}
+        for group, spec in definition.get('groups', {}).items():
+            topic = self._topic(spec['topic'], group)
+            self.groups[group] = {
+                'description': spec.get('description', ''),
+                'payload_template': spec.get('payload_template', {}),
+                'devices': [{'device': device, 'topic': topic} for device in spec['devices']]
             }
+            self.keywords[group] = tuple(spec.get('keywords', ()))
+        self.tools = {name: command.as_tool() for name, command in self.commands.items()}
+
+    def _topic(self, key: str, owner: str) -> str:
+        if key not in self.topics:
+            raise ValueError(f"Unknown topic '{key}' for {owner}. Must be one of: {', '.join(self.topics)}")
+        return self.topics[key]
+
+
+@st.cache_resource
+def load_device_registry(path: str, modified: float) -> DeviceRegistry:
+    """Load and check the device registry file; cached until the file changes.
+
+    Args:
+        path: The registry JSON file
+        modified: The file's modification time, so an edited file is reloaded on the next rerun
+    """
+    with open(path) as f:
+        return DeviceRegistry(json.load(f))
+
+
+DEVICE_REGISTRY = load_device_registry(DEVICE_REGISTRY_FILE, os.path.getmtime(DEVICE_REGISTRY_FILE))
+DEVICE_GROUPS = DEVICE_REGISTRY.groups
+SUIT_ACTION_TOPIC = DEVICE_REGISTRY.topics['suit_action']
+
+# Device tools generated from the registry
+control_cat_feeder_iot = DEVICE_REGISTRY.tools['control_cat_feeder_iot']
+set_iron_man_mark3_helmet_action = DEVICE_REGISTRY.tools['set_iron_man_mark3_helmet_action']
+
+
+def send_cat_feeder_message(action: str) -> dict:
+    """
+    Send a motor command to the cat feeder at its default speed, for the Cat Feeder tab and the scheduler.
+    
+    Args:
+        action (str): One of "forward", "stop" and "backward"
+    
+    Returns:
+        dict: The control_cat_feeder_iot result
+    """
+    return control_cat_feeder_iot(action)
+
+def send_scheduled_feeder_stop() -> dict:
+    """
+    Send the 'stop' that ends a timed feed, for the command scheduler.
+    
+    This bypasses the tool, which cancels the feeder's pending scheduled command, as this
+    is that command.
+    
+    Returns:
+        dict: The DeviceCommand.send result
+    """
+    command = DEVICE_REGISTRY.commands['control_cat_feeder_iot']
+    return command.send(action="stop", speed=command.parameters['speed']['default'])
+
+def start_timed_feed(seconds: int) -> dict:
+    """
+    Start the cat feeder and schedule it to stop after the given number of seconds.
+    
+    The 'stop' is queued on the command scheduler, so this returns as soon as the
+    'forward' command is queued. No stop is scheduled if the 'forward' failed.
+    
+    Args:
+        seconds (int): How long to feed for, from 1 to TIMED_FEED_MAX_SECONDS
+    
+    Returns:
+        dict: The 'forward' result and, unless it failed, the seconds until the feeder stops
+    """
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or not 1 <= seconds <= TIMED_FEED_MAX_SECONDS:
+        return {'status': 'error', 'error': f"Invalid seconds: {seconds!r}. Must be a number from 1 to {TIMED_FEED_MAX_SECONDS}"}
+    result = send_cat_feeder_message("forward")
+    if result["status"] == "error":
+        return result
+    # A debounced 'forward' repeats one just queued, so the feeder is running and still needs its stop
+    stops_in = get_command_scheduler().schedule(CAT_FEEDER_DEVICE, seconds, send_scheduled_feeder_stop)
+    result["stops_in_seconds"] = round(stops_in, 1)
+    return result
+
+@instrumented_tool
+def feed_cat_for_seconds(seconds: int) -> dict:
+    """
+    Feed the cat for the specified number of seconds. The cat feeder is started now and
+    stopped automatically in the background, so there is no need to sleep or send 'stop'.
+    
+    Args:
+        seconds (int): The number of seconds to feed for, from 1 to 3600
+    
+    Returns:
+        dict: The status of the feed and the seconds until the feeder stops
+    """
+    return start_timed_feed(seconds)
+
+@instrumented_tool
+@tool_execution(timeout_seconds=None)
+async def sleep_seconds(seconds: int) -> str:
+    """
+    Pauses execution for the specified number of seconds.
+    To feed the cat for a number of seconds, use feed_cat_for_seconds instead.
+    Tool calls made together run at the same time, so to wait between two commands,
+    call this on its own and send the next command after it returns.
+    
+    Args:
+        seconds (int): The number of seconds to sleep
+    
+    Returns:
+        str: Confirmation message with the number of seconds slept
+    """
+    await asyncio.sleep(seconds)
+    return f"Slept for {seconds} seconds"
+
+
+
+@instrumented_tool
+def house_party_protocol() -> dict:
+    """Nova, initiate House Party Protocol.
+    
+    This tool activates the House Party Protocol from Iron Man 3, where Tony Stark
+    remotely activated his Iron Legion of suits.
+    
+    Returns:
+        dict: How many suits' activation commands were queued, and their command IDs
+    """
+    try:
+        # Send the activation to every suit in the Iron Legion at once
+        payload = {
+            "action": "house_party_protocol",
+            "message": "Deploying Iron Legion"
         }
-    ]
+        result = publish_to_group('iron_legion', payload)
+        
+        # Commands are published asynchronously by the command outbox; look up their
+        # outcome with get_command_status
+        queued = [r for r in result['results'] if r['status'] == 'queued']
+        return {
+            'status': 'queued' if result['failed'] == 0 else 'partial' if queued else 'error',
+            'message': "House Party Protocol queued for the Iron Legion, each suit's command is published asynchronously",
+            'topic': SUIT_ACTION_TOPIC,
+            'suits_queued': f"{len(queued)} of {result['devices']} suits",
+            'payload': payload,
+            'command_ids': [r['command_id'] for r in queued],
+            'debounced': result['debounced'],
+            'failed': [r for r in result['results'] if r['status'] == 'error'],
+            'wall_ms': result['wall_ms']
+        }
+        
+    except Exception as e:
+        # Per-suit publish errors are reported in the result, this only catches unexpected failures
+        error_result = {
+            'status': 'error',
+            'error': f"Unexpected error: {str(e)}"
+        }
+        logger.exception("Unexpected error sending House Party Protocol message", extra=error_result)
+        return error_result
+
+@instrumented_tool
+def send_group_command(group: str, action: str) -> dict:
+    """Send the same action to every device in a device group at once, e.g. all suits in the Iron Legion.
     
-    print(f"Retrieved telemetry data for {len(static_data)} vehicles:")
-    for vehicle in static_data:
-        measurements = vehicle.get('measurements', {})
-        print(f"Vehicle: {vehicle.get('vehicle_name', 'Unknown')} - "
-              f"Temperature: {measurements.get('temperature', 'N/A')}°C, "
-              f"Humidity: {measurements.get('humidity', 'N/A')}%")
+    Args:
+        group: The device group, currently 'iron_legion' (Iron Man suits Mark 15 to Mark 42)
+        action: The action for every device in the group, e.g. 'face_open', 'face_close' or 'house_party_protocol'
+
+    Returns:
+        A dictionary with the number of devices queued, debounced and failed, the total time and
+        per-device results with their command IDs. Commands are published asynchronously.
+    """
+    try:
+        result = publish_to_group(group, {"action": action})
+        result['status'] = 'queued' if result['failed'] == 0 else 'partial' if result['queued'] else 'error'
+        return result
+    except ValueError as e:
+        return {'status': 'error', 'error': str(e)}
+
+@instrumented_tool
+def get_command_status(command_ids: list) -> dict:
+    """Check whether queued device commands were published. Device tools queue their command
+    and return at once, so use this to confirm the outcome of a command.
     
-    return static_data
+    Args:
+        command_ids: The command IDs returned by the device tools
+
+    Returns:
+        A dictionary with a list of statuses, one per command: 'queued', 'publishing', 'retrying',
+        'published', 'superseded' (replaced by a newer command for the device), 'failed' or 'unknown'
+    """
+    outbox = get_command_outbox()
+    statuses = []
+    for command_id in command_ids:
+        try:
+            # bool is an int subclass, but True is not a command ID
+            if isinstance(command_id, bool):
+                raise ValueError(command_id)
+            statuses.append(outbox.status(int(command_id)))
+        except (TypeError, ValueError):
+            statuses.append({'command_id': command_id, 'status': 'unknown', 'detail': 'Unknown command id'})
+    return {'status': 'success', 'commands': statuses}
+
+# Strands agent settings
+AGENT_MODEL_ID = os.environ.get("AGENT_MODEL_ID", "us.amazon.nova-pro-v1:0")
+
+# Chat streaming settings: redraw the response at most every interval or every N tokens
+STREAM_FLUSH_INTERVAL_SECONDS = float(os.environ.get("STREAM_FLUSH_INTERVAL_SECONDS", "0.1"))
+STREAM_FLUSH_TOKENS = int(os.environ.get("STREAM_FLUSH_TOKENS", "20"))
+
+# Agent execution settings: turns running at once, and turns allowed to wait for a worker
+AGENT_MAX_CONCURRENT_TURNS = int(os.environ.get("AGENT_MAX_CONCURRENT_TURNS", "4"))
+AGENT_MAX_QUEUED_TURNS = int(os.environ.get("AGENT_MAX_QUEUED_TURNS", "16"))
+
+# How long the chat waits for an agent turn before reporting it as timed out
+AGENT_TURN_TIMEOUT_SECONDS = float(os.environ.get("AGENT_TURN_TIMEOUT_SECONDS", "120"))
+
+# Conversation memory settings: once a session's history is estimated above the token budget,
+# older messages are summarized, always keeping the most recent messages verbatim
+AGENT_CONTEXT_TOKEN_BUDGET = int(os.environ.get("AGENT_CONTEXT_TOKEN_BUDGET", "8000"))
+AGENT_PRESERVE_RECENT_MESSAGES = int(os.environ.get("AGENT_PRESERVE_RECENT_MESSAGES", "10"))
+
+# Chat messages drawn per page in the chat tab; older ones are loaded on request
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", "20"))
+
+# All tools available to the Strands agent
+AGENT_TOOLS = [
+    get_vehicle_telemetry, 
+    query_vehicle_telemetry,
+    summarize_vehicle_telemetry,
+    analyze_fleet_telemetry,
+    feed_cat_for_seconds,
+    sleep_seconds,
+    *DEVICE_REGISTRY.tools.values(),
+    house_party_protocol,
+    send_group_command,
+    get_command_status
+]
+
+# How the tool specs sent with each model request are chosen: 'keyword' sends only the
+# tools whose keywords appear in the user's latest message (all tools if none match),
+# 'all' sends every tool
+AGENT_TOOL_SELECTION = os.environ.get("AGENT_TOOL_SELECTION", "keyword")
+
+# Words that select the built-in tools; matched case-insensitively at the start of a word.
+# Registry tools use their device's or group's keywords from the registry file.
+TELEMETRY_KEYWORDS = ('vehicle', 'car', 'fleet', 'telemetry', 'sensor', 'reading', 'temperature', 'humidity', 'light',
+                      'altitude', 'pitch', 'roll', 'tilt', 'location', 'latitude', 'longitude', 'anomal', 'average', 'summar')
+TOOL_KEYWORDS = {
+    'get_vehicle_telemetry': TELEMETRY_KEYWORDS,
+    'query_vehicle_telemetry': TELEMETRY_KEYWORDS,
+    'summarize_vehicle_telemetry': TELEMETRY_KEYWORDS,
+    'analyze_fleet_telemetry': TELEMETRY_KEYWORDS,
+    'feed_cat_for_seconds': ('cat', 'feed', 'food', 'second'),
+    'sleep_seconds': ('sleep', 'wait', 'pause', 'then', 'after', 'second', 'minute'),
+    'get_command_status': ('status', 'command', 'queued', 'publish', 'sent', 'did', 'work', 'check', 'confirm')
+}
+
+
+def get_tool_keywords() -> dict:
+    """Return the selecting keywords of every agent tool, by tool name.
+
+    Generated device tools use their device's keywords, and the group tools use the
+    keywords and names of every registry group.
+    """
+    group_keywords = tuple(itertools.chain.from_iterable((group, *DEVICE_REGISTRY.keywords[group]) for group in DEVICE_REGISTRY.groups))
+    return {
+        **TOOL_KEYWORDS,
+        **{name: DEVICE_REGISTRY.keywords[name] for name in DEVICE_REGISTRY.tools},
+        'house_party_protocol': group_keywords,
+        'send_group_command': group_keywords
+    }
+
+
+class ToolSelector:
+    """Chooses which tool specs to send with a model request from the user's latest message.
+
+    Every tool spec is part of the prompt on every model call, so with many device types
+    most of the input tokens would describe tools the request has nothing to do with.
+    Tools without keywords are always sent, as are tools already called in the current
+    turn, and every tool is sent when no keyword matches so the model is never left
+    without the tool it needs.
+    """
+
+    def __init__(self, keywords: dict):
+        self._patterns = {
+            name: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + ")", re.IGNORECASE)
+            for name, words in keywords.items() if words
+        }
+        self._metrics = get_metrics()
+        self._lock = threading.Lock()
+        self._selections = 0
+        self._fallbacks = 0
+        self._specs_sent = 0
+        self._specs_skipped = 0
+        self._tokens_saved = 0
+
+    def select(self, tool_specs: list, messages: list) -> list:
+        """Return the tool specs relevant to the current turn.
+
+        Args:
+            tool_specs: Every tool spec the agent has
+            messages: The conversation, ending with the current turn
+
+        Returns:
+            The tool specs to send, in their original order
+        """
+        if not tool_specs:
+            return tool_specs
+        prompt, called = self._current_turn(messages)
+        selected = {name for name, pattern in self._patterns.items() if pattern.search(prompt)}
+        if selected:
+            selected |= called
+            chosen = [spec for spec in tool_specs if spec['name'] in selected or spec['name'] not in self._patterns]
+        else:
+            chosen = tool_specs
+        chosen_names = {spec['name'] for spec in chosen}
+        skipped = [spec for spec in tool_specs if spec['name'] not in chosen_names]
+        tokens_saved = estimate_tokens(skipped)
+
+        with self._lock:
+            self._selections += 1
+            self._fallbacks += not selected
+            self._specs_sent += len(chosen)
+            self._specs_skipped += len(skipped)
+            self._tokens_saved += tokens_saved
+        self._metrics.inc("tool_specs_sent_total", len(chosen))
+        self._metrics.inc("tool_specs_skipped_total", len(skipped))
+        self._metrics.inc("tool_spec_tokens_saved_total", tokens_saved)
+        return chosen
+
+    @staticmethod
+    def _current_turn(messages: list) -> tuple:
+        # The turn starts at the latest user message with text, later user messages carry tool results
+        called = set()
+        for message in reversed(messages):
+            texts = [block['text'] for block in message['content'] if 'text' in block]
+            if message['role'] == 'user' and texts:
+                return " ".join(texts), called
+            called.update(block['toolUse']['name'] for block in message['content'] if 'toolUse' in block)
+        return "", called
+
+    def stats(self) -> dict:
+        """Return counts of model requests, keyword misses, and tool specs sent and skipped."""
+        with self._lock:
+            return {
+                'requests': self._selections,
+                'fallbacks': self._fallbacks,
+                'avg_tools_sent': round(self._specs_sent / self._selections, 1) if self._selections else None,
+                'specs_skipped': self._specs_skipped,
+                'est_tokens_saved': self._tokens_saved
+            }
+
+
+@st.cache_resource
+def get_tool_selector(registry_version: str) -> ToolSelector:
+    """Return the process-wide tool selector for a version of the device registry.
+
+    Args:
+        registry_version: DEVICE_REGISTRY.version, so an edited registry gets a selector
+            with its new keywords
+    """
+    return ToolSelector(get_tool_keywords())
+
+
+def estimate_tokens(messages: list) -> int:
+    """Roughly estimate the model tokens in a list of messages at four characters per token."""
+    return len(json.dumps(messages, default=str)) // 4
+
+
+def make_conversation_manager(token_budget: int = AGENT_CONTEXT_TOKEN_BUDGET, preserve_recent_messages: int = AGENT_PRESERVE_RECENT_MESSAGES):
+    """Create a conversation manager that keeps an agent's history within a token budget.
+
+    After every turn, while the estimated size of the history is over the budget, the
+    oldest messages are replaced with a model-written summary, keeping the most recent
+    messages verbatim. This keeps the prompt, and so the latency and cost of each turn,
+    flat however long a session runs.
 
-@tool
-def send_cat_feeder_message(action: str) -> dict:
-    """
-    Send an MQTT message to activate the cat feeder at AWS Sydney Summit.
-    
     Args:
-        action (str): The string value for the action property, these are the allowed values "forward", "stop" and "backward"
-    
+        token_budget: Estimated tokens of history to keep
+        preserve_recent_messages: Messages always kept verbatim
+
     Returns:
-        dict: The response from the IoT publish operation
+        A TokenBudgetConversationManager
     """
-    # Create an IoT client
-    iot_client = boto3.client('iot-data')
-    
-    # Create message with required action property
-    message = {"action": action, "speed": 180}
-    
-    # Convert message to JSON string
-    message_json = json.dumps(message)
-    
-    # Publish the message to the IoT topic
-    topic = "my-project-iot-house-telemetry-house-telemetry-action"
-    response = iot_client.publish(
-        topic=topic,
-        qos=1,  # Quality of Service: 1 means at least once delivery
-        payload=message_json
-    )
-    
-    return {"topic": topic, "action": action, "status": "sent", "response": str(response)}
+    return _token_budget_conversation_manager_class()(token_budget, preserve_recent_messages)
+
+
+@functools.lru_cache(maxsize=None)
+def _token_budget_conversation_manager_class() -> type:
+    # Defined on first use so Strands is only imported when an agent is built
+    class TokenBudgetConversationManager(strands_conversation_manager.SummarizingConversationManager):
+        def __init__(self, token_budget: int, preserve_recent_messages: int):
+            super().__init__(preserve_recent_messages=preserve_recent_messages)
+            self.token_budget = token_budget
+            self.summaries = 0
+
+        def apply_management(self, agent, **kwargs):
+            while estimate_tokens(agent.messages) > self.token_budget:
+                message_count = len(agent.messages)
+                # Summarization failures are logged and leave the history as it is
+                self.reduce_context(agent)
+                if len(agent.messages) >= message_count:
+                    break
+                self.summaries += 1
+
+    return TokenBudgetConversationManager
+
+
+def make_tool_selecting_model(model, selector: ToolSelector = None):
+    """Wrap a model so each request only carries the tool specs the selector picks.
 
-@tool
-def sleep_seconds(seconds: int) -> str:
-    """
-    Pauses execution for the specified number of seconds.
-    
     Args:
-        seconds (int): The number of seconds to sleep
-    
+        model: The Strands model to wrap
+        selector: The tool selector (default: the process-wide one)
+
     Returns:
-        str: Confirmation message with the number of seconds slept
+        A ToolSelectingModel, or the model itself when AGENT_TOOL_SELECTION is 'all'
     """
-    time.sleep(seconds)
-    return f"Slept for {seconds} seconds"
+    if AGENT_TOOL_SELECTION == "all":
+        return model
+    return _tool_selecting_model_class()(model, selector or get_tool_selector(DEVICE_REGISTRY.version))
 
 
+@functools.lru_cache(maxsize=None)
+def _tool_selecting_model_class() -> type:
+    # Defined on first use so Strands is only imported when an agent is built
+    class ToolSelectingModel(strands_models.Model):
+        def __init__(self, model, selector: ToolSelector):
+            self.model = model
+            self.selector = selector
+
+        def __getattr__(self, name):
+            # Anything not overridden here, e.g. the model's config, comes from the wrapped model
+            if name == 'model':
+                raise AttributeError(name)
+            return getattr(self.model, name)
+
+        def update_config(self, **model_config):
+            self.model.update_config(**model_config)
+
+        def get_config(self):
+            return self.model.get_config()
+
+        def structured_output(self, *args, **kwargs):
+            return self.model.structured_output(*args, **kwargs)
+
+        def count_tokens(self, *args, **kwargs):
+            return self.model.count_tokens(*args, **kwargs)
+
+        async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+            tool_specs = self.selector.select(tool_specs, messages)
+            async for event in self.model.stream(messages, tool_specs, system_prompt, **kwargs):
+                yield event
+
+    return ToolSelectingModel
+
+
+def get_strands_tools(tools: list) -> list:
+    """Wrap tool functions as async Strands tools, reusing earlier wrappers.
 
-# Iron Man tools ported from Lambda MCP to Strands
-@tool
-def set_iron_man_mark3_helmet_action(faceplate_state: str, eyes_state: str) -> str:
-    """Set the state of the Iron Man Mark 3 Helmet
-    
     Args:
-        faceplate_state: The state of the Faceplate, the allowable states are 'face_open' or 'face_close'
-        eyes_state: The state of the Eyes, the allowable states are 'on' or 'off'
+        tools: Functions marked with @instrumented_tool
+
+    Returns:
+        The Strands tools, in the same order
+    """
+    return [_as_strands_tool(func) for func in tools]
+
+
+@functools.lru_cache(maxsize=None)
+def _as_strands_tool(func):
+    return strands.tool(make_async_tool(func))
+
+
+def make_tool_executor():
+    """Create the Strands tool executor selected by AGENT_TOOL_EXECUTION."""
+    if AGENT_TOOL_EXECUTION == "sequential":
+        return strands_tool_executors.SequentialToolExecutor()
+    return strands_tool_executors.ConcurrentToolExecutor()
+
+
+@st.cache_resource
+def setup_tracing() -> bool:
+    """Send Strands' OpenTelemetry traces of agent turns, model calls and tool calls to OTLP, if configured.
+
+    Set OTEL_EXPORTER_OTLP_ENDPOINT (and optionally OTEL_EXPORTER_OTLP_HEADERS) to enable.
+    Requires `pip install 'strands-agents[otel]'`.
 
     Returns:
-        A string confirming the action
+        True if tracing was enabled
     """
+    if not os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return False
     try:
-        # Create an IoT client
-        iot_client = boto3.client('iot-data')
-        
-        topic = "my-project-iot-suit-telemetry-suit-telemetry-action"
-        payload = {"suit_name": "XIAOMark3Helmet", "action": faceplate_state, "eyes": eyes_state}
+        strands_telemetry = LazyModule("strands.telemetry")
+        strands_telemetry.StrandsTelemetry().setup_otlp_exporter()
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OTLP exporter is missing, run: pip install 'strands-agents[otel]'")
+        return False
+    logger.info("Exporting traces", extra={'endpoint': os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"]})
+    return True
 
-        # Convert payload to JSON string
-        message_json = json.dumps(payload)
-        
-        # Publish the message
-        iot_client.publish(
-            topic=topic,
-            qos=1,  # QoS 1 for at least once delivery
-            payload=message_json
-        )
-        
-        return f"The payload sent to topic is {message_json}"
-        
-    except ClientError as e:
-        error_message = f"Error sending message to IoT topic: {str(e)}"
-        print(error_message)
-        return error_message
-    except Exception as e:
-        error_message = f"Unexpected error: {str(e)}"
-        print(error_message)
-        return error_message
 
-@tool
-def control_cat_feeder_iot(action: str, speed: int = 180) -> dict:
-    """Control the Cat Feeder motor via IoT Core, this Cat Feeder is currently on location at the AWS Sydney Summit 2025 event. We are Live at the event on June 4th and 5th. 
-    
+@st.cache_resource
+def get_bedrock_model(model_id: str) -> strands_models.BedrockModel:
+    """Return the Bedrock model shared by every session.
+
+    The model owns the bedrock-runtime client, so sharing it means the client, its
+    connection pool and resolved credentials are created once per process.
+    """
+    with get_startup_profile().measure("client", "bedrock-runtime"):
+        return strands_models.BedrockModel(model_id=model_id)
+
+
+def get_session_agent(model_id: str = AGENT_MODEL_ID, tools: list = None) -> strands.Agent:
+    """Return the Strands agent for the current browser session.
+
+    Streamlit reruns the whole script on every widget interaction, so the agent is cached
+    in session state and only rebuilt when the model, the tool set or the device registry
+    changes.
+
     Args:
-        action: The action to perform, must be one of: 'forward', 'backward', 'stop'
-        speed: The motor speed (default: 180)
+        model_id: The Bedrock model ID the agent uses
+        tools: The tools to give the agent (default: AGENT_TOOLS)
 
     Returns:
-        A dictionary with the status of the operation
+        The cached or newly built Agent
     """
-    try:
-        # Validate action parameter
-        valid_actions = ['forward', 'backward', 'stop']
-        if action not in valid_actions:
+    tools = AGENT_TOOLS if tools is None else tools
+    # The registry version catches an edited device command whose tool name stays the same
+    key = (model_id, DEVICE_REGISTRY.version, tuple(getattr(t, 'tool_name', getattr(t, '__name__', repr(t))) for t in tools))
+
+    cached = st.session_state.get("agent_cache")
+    if cached is not None and cached["key"] == key:
+        cached["reuses"] += 1
+        return cached["agent"]
+
+    setup_tracing()
+    start = time.perf_counter()
+    with get_startup_profile().measure("client", "agent"):
+        agent = strands.Agent(
+            model=make_tool_selecting_model(get_bedrock_model(model_id)),
+            tools=get_strands_tools(tools),
+            # Messages answered before the agent was built, see remember_exchange()
+            messages=st.session_state.pop("pending_agent_messages", None),
+            conversation_manager=make_conversation_manager(),
+            tool_executor=make_tool_executor()
+        )
+    build_ms = (time.perf_counter() - start) * 1000
+
+    st.session_state.agent_cache = {"key": key, "agent": agent, "build_ms": build_ms, "reuses": 0}
+    return agent
+
+@st.cache_resource
+def get_agent_executor() -> AgentExecutor:
+    """Return the process-wide agent executor, created on first use."""
+    return AgentExecutor(AGENT_MAX_CONCURRENT_TURNS, AGENT_MAX_QUEUED_TURNS, get_metrics())
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase a prompt and drop surrounding punctuation and repeated whitespace."""
+    return " ".join(prompt.lower().split()).strip(" .!?")
+
+
+def get_tool_call_counts(agent: strands.Agent) -> dict:
+    """Return how many times the agent has called each tool, to diff across a turn."""
+    return {name: metrics.call_count for name, metrics in agent.event_loop_metrics.tool_metrics.items()}
+
+
+class ResponseCache(TTLCache):
+    """Caches agent answers by normalized prompt so repeated questions skip the model.
+
+    Only answers whose turn called at least one tool, and nothing but READ_ONLY_TOOLS,
+    are cached, so a repeated command such as "open the helmet" always reaches the device
+    even if the model once answered it without calling a tool. Answers that read
+    telemetry are tied to the telemetry store version they saw, and every answer to the
+    conversation before it, so a follow-up such as "yes, do it" is never replayed into a
+    different conversation.
+    """
+
+    def key(self, model_id: str, prompt: str, history: list) -> tuple:
+        """Return the cache key for a prompt.
+
+        Take the key before the turn runs: if telemetry changes during the turn, the store
+        version moves past the key and the answer is never served.
+
+        Args:
+            model_id: The Bedrock model ID
+            prompt: The user's message
+            history: The chat messages before this one
+        """
+        history_digest = hashlib.sha256(json.dumps(history, default=str).encode()).hexdigest()
+        return (model_id, normalize_prompt(prompt), history_digest, get_telemetry_store().version)
+
+    def store(self, key: tuple, text: str, tool_names: set, turn_ms: float, tokens: int) -> bool:
+        """Cache an answer if its turn was read-only.
+
+        Args:
+            key: The key from key(), taken before the turn
+            text: The agent's answer
+            tool_names: Names of the tools the turn called
+            turn_ms: How long the turn took
+            tokens: Model tokens the turn used
+
+        Returns:
+            True if the answer was cached
+        """
+        # An empty set is a subset of anything, so a turn that called no tools is not read-only
+        if not text or not tool_names or not tool_names <= READ_ONLY_TOOLS:
+            return False
+        self.put(key, text, cost_ms=turn_ms, tokens=tokens)
+        return True
+
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Return the response cache shared by every session."""
+    cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+    get_metrics().add_collector(lambda: cache_gauges("responses", cache))
+    return cache
+
+
+# Answer simple commands with a fast-path intent instead of the agent, when the whole
+# message matches one
+FAST_PATH_ROUTING = os.environ.get("FAST_PATH_ROUTING", "true").lower() in ("1", "true", "yes")
+
+# Fast-path intents: a pattern the whole normalized message must match, the tool to call
+# with arguments taken from the match, and the reply, formatted with the arguments and the
+# tool's result. Device commands are queued on the command outbox, so replies say so. An intent without a tool is answered from the reply alone.
+FEEDER = r"(?:the )?(?:cat )?feeder"
+HELMET = r"(?:the )?(?:helmet|faceplate|face plate|visor)"
+FAST_PATH_INTENTS = [
+    {'intent': 'tools', 'pattern': r"tools|help|list (?:the )?tools|what tools do you have|what can you do", 'tool': None},
+    {'intent': 'feeder_stop', 'pattern': rf"stop {FEEDER}", 'tool': control_cat_feeder_iot,
+     'arguments': lambda match: {'action': 'stop'}, 'reply': "Stop command queued for the cat feeder"},
+    {'intent': 'feeder_forward', 'pattern': rf"(?:start|run) {FEEDER}(?: forwards?)?|(?:move|run|turn) {FEEDER} forwards?", 'tool': control_cat_feeder_iot,
+     'arguments': lambda match: {'action': 'forward'}, 'reply': "Forward command queued for the cat feeder"},
+    {'intent': 'feeder_backward', 'pattern': rf"(?:move|run|turn) {FEEDER} backwards?|reverse {FEEDER}", 'tool': control_cat_feeder_iot,
+     'arguments': lambda match: {'action': 'backward'}, 'reply': "Backward command queued for the cat feeder"},
+    {'intent': 'feed_cat', 'pattern': r"feed (?:the )?cat for (\d{1,2}) seconds?", 'tool': feed_cat_for_seconds,
+     'arguments': lambda match: {'seconds': int(match.group(1))}, 'reply': "Feed command queued, the feeder is scheduled to stop in {stops_in_seconds:.0f} seconds 😺"},
+    {'intent': 'helmet_open', 'pattern': rf"open {HELMET}", 'tool': set_iron_man_mark3_helmet_action,
+     'arguments': lambda match: {'faceplate_state': 'face_open', 'eyes_state': 'on'}, 'reply': "Open command queued for the helmet faceplate, eyes on"},
+    {'intent': 'helmet_close', 'pattern': rf"close {HELMET}", 'tool': set_iron_man_mark3_helmet_action,
+     'arguments': lambda match: {'faceplate_state': 'face_close', 'eyes_state': 'on'}, 'reply': "Close command queued for the helmet faceplate, eyes on"},
+    {'intent': 'house_party', 'pattern': r"(?:(?:initiate|activate|start) )?(?:the )?house party protocol", 'tool': house_party_protocol,
+     'arguments': lambda match: {}, 'reply': "House Party Protocol queued for {suits_queued}"}
+]
+
+
+def describe_tools(tools: list) -> str:
+    """Return a markdown list of tools with the first paragraph of each docstring."""
+    lines = ["These are the tools I can use:", ""]
+    for func in tools:
+        summary = " ".join(inspect.getdoc(func).split("\n\n")[0].split())
+        lines.append(f"- **{func.__name__}**: {summary}")
+    return "\n".join(lines)
+
+
+class IntentRouter:
+    """Answers simple, unambiguous commands by calling the tool directly, without the model.
+
+    A message is only routed when the whole normalized message matches an intent's
+    pattern, so anything with extra conditions, questions or several commands falls back
+    to the agent. Routed commands call the same instrumented tool functions the agent
+    would, and take milliseconds instead of a model round trip.
+    """
+
+    def __init__(self, intents: list = FAST_PATH_INTENTS, tools: list = None):
+        self._intents = [
+            (intent, re.compile(rf"(?:please )?(?:{intent['pattern']})(?: please)?"))
+            for intent in intents
+        ]
+        self._tools_text = describe_tools(AGENT_TOOLS if tools is None else tools)
+        self._metrics = get_metrics()
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._fallbacks = 0
+        self._fast_ms = 0.0
+        self._agent_turns = 0
+        self._agent_ms = 0.0
+
+    def route(self, prompt: str) -> dict:
+        """Answer a message on the fast path if it matches an intent.
+
+        Args:
+            prompt: The user's message
+
+        Returns:
+            A dict with the intent, the reply text, the tool result and the time taken,
+            or None if the message should go to the agent
+        """
+        start = time.perf_counter()
+        normalized = normalize_prompt(prompt)
+        for intent, pattern in self._intents:
+            match = pattern.fullmatch(normalized)
+            if match:
+                break
+        else:
+            with self._lock:
+                self._fallbacks += 1
+            self._metrics.inc("fast_path_total", intent="none")
+            return None
+
+        result = None
+        if intent['tool'] is None:
+            text = self._tools_text
+        else:
+            arguments = intent['arguments'](match)
+            result = intent['tool'](**arguments)
+            text = self._reply(intent['reply'], arguments, result)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._hits[intent['intent']] = self._hits.get(intent['intent'], 0) + 1
+            self._fast_ms += duration_ms
+        self._metrics.inc("fast_path_total", intent=intent['intent'])
+        self._metrics.observe("fast_path_latency_ms", duration_ms)
+        logger.info("Fast path", extra={'event': 'fast_path', 'intent': intent['intent'], 'duration_ms': round(duration_ms, 2)})
+        return {'intent': intent['intent'], 'text': text, 'result': result, 'duration_ms': round(duration_ms, 1)}
+
+    @staticmethod
+    def _reply(reply: str, arguments: dict, result: dict) -> str:
+        if result.get('status') == 'error':
+            return f"Sorry, that didn't work: {result.get('error', 'the command failed')}"
+        if result.get('status') == 'debounced':
+            return result['message']
+        # Commands are queued, so say so rather than claim the device has moved
+        text = reply.format(**arguments, **result)
+        if 'command_id' in result:
+            text += f" (command {result['command_id']}, published asynchronously)"
+        return text
+
+    def record_agent_turn(self, duration_ms: float):
+        """Record how long a message that fell back to the agent took, to estimate the time saved."""
+        with self._lock:
+            self._agent_turns += 1
+            self._agent_ms += duration_ms
+
+    def stats(self) -> dict:
+        """Return the hit rate, hits per intent and the estimated latency saved by the fast path."""
+        with self._lock:
+            hits = sum(self._hits.values())
+            routed = hits + self._fallbacks
+            avg_fast_ms = self._fast_ms / hits if hits else None
+            avg_agent_ms = self._agent_ms / self._agent_turns if self._agent_turns else None
             return {
-                'status': 'error',
-                'error': f"Invalid action: {action}. Must be one of: {', '.join(valid_actions)}"
+                'messages': routed,
+                'hits': hits,
+                'hit_rate': round(hits / routed, 3) if routed else None,
+                'by_intent': dict(self._hits),
+                'avg_fast_path_ms': round(avg_fast_ms, 1) if avg_fast_ms is not None else None,
+                'avg_agent_turn_ms': round(avg_agent_ms, 1) if avg_agent_ms is not None else None,
+                'est_saved_ms': round(hits * (avg_agent_ms - avg_fast_ms), 1) if hits and avg_agent_ms is not None else None
             }
-        
-        # Create an IoT client
-        iot_client = boto3.client('iot-data')
-        
-        # Define topic and payload
-        topic = "my-project-iot-house-telemetry-house-telemetry-action"
-        payload = {
-            "action": action,
-            "speed": speed
-        }
 
-        # Convert payload to JSON string
-        message_json = json.dumps(payload)
-        
-        # Publish the message
-        response = iot_client.publish(
-            topic=topic,
-            qos=1,  # QoS 1 for at least once delivery
-            payload=message_json
-        )
-        
+
+@st.cache_resource
+def get_intent_router() -> IntentRouter:
+    """Return the fast-path intent router shared by every session."""
+    router = IntentRouter()
+    get_metrics().add_collector(lambda: [("fast_path_saved_ms", {}, router.stats()['est_saved_ms'] or 0)])
+    return router
+
+
+def remember_exchange(prompt: str, text: str):
+    """Add a message answered without the agent to the session's agent conversation.
+
+    The exchange is held until it can be added to the agent's messages, so later turns
+    can refer back to it: when the agent is built, or now if the agent isn't running a turn.
+    """
+    exchange = [{"role": "user", "content": [{"text": prompt}]}, {"role": "assistant", "content": [{"text": text}]}]
+    st.session_state.setdefault("pending_agent_messages", []).extend(exchange)
+    cached = st.session_state.get("agent_cache")
+    if cached is not None:
+        add_pending_messages(cached["agent"])
+
+
+def add_pending_messages(agent: strands.Agent):
+    """Append the session's held exchanges to its agent, unless a turn is still running.
+
+    A turn that timed out in the page may still be appending to the agent's messages, so
+    the exchanges are only added while holding the agent's lock, and otherwise kept for
+    the next message.
+    """
+    pending = st.session_state.get("pending_agent_messages")
+    if pending and get_agent_executor().update_agent(agent, lambda agent: agent.messages.extend(pending)):
+        st.session_state.pending_agent_messages = []
+
+
+class StreamingMarkdownRenderer:
+    """Renders a streamed agent response into a Streamlit placeholder at a bounded rate.
+
+    Chunks are buffered in a list and the placeholder is only redrawn when the flush
+    interval has passed or enough tokens are pending, instead of re-sending the whole
+    response on every token. Each streamed chunk counts as one token.
+    """
+
+    def __init__(self, placeholder, flush_interval: float = STREAM_FLUSH_INTERVAL_SECONDS, flush_tokens: int = STREAM_FLUSH_TOKENS):
+        self._placeholder = placeholder
+        self._flush_interval = flush_interval
+        self._flush_tokens = flush_tokens
+        self._parts = []
+        self._pending_tokens = 0
+        self._last_flush = 0.0
+        self._started = time.perf_counter()
+        self._first_token = None
+        self._last_token = None
+        self.token_count = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def append(self, chunk: str, force_flush: bool = False):
+        """Buffer a chunk of the response and redraw if a flush is due."""
+        now = time.perf_counter()
+        if self._first_token is None:
+            self._first_token = now
+        self._last_token = now
+        self._parts.append(chunk)
+        self.token_count += 1
+        self._pending_tokens += 1
+
+        if force_flush or self._pending_tokens >= self._flush_tokens or now - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Redraw the placeholder with everything buffered so far."""
+        if self._pending_tokens == 0:
+            return
+        self._placeholder.markdown(self.text)
+        self._pending_tokens = 0
+        self._last_flush = time.perf_counter()
+
+    def finish(self) -> dict:
+        """Flush any remaining chunks and return the streaming metrics for this turn."""
+        self.flush()
+        ttft_ms = None
+        tokens_per_second = None
+        if self._first_token is not None:
+            ttft_ms = round((self._first_token - self._started) * 1000, 1)
+            streaming_seconds = self._last_token - self._first_token
+            if streaming_seconds > 0:
+                tokens_per_second = round(self.token_count / streaming_seconds, 1)
         return {
-            'status': 'success',
-            'message': f"Motor command sent: {action} with speed {speed}",
-            'topic': topic,
-            'payload': payload
-        }
-        
-    except ClientError as e:
-        error_result = {
-            'status': 'error',
-            'error': str(e),
-            'topic': topic if 'topic' in locals() else 'unknown'
-        }
-        print(f"Error sending message to IoT topic: {json.dumps(error_result)}")
-        return error_result
-    except Exception as e:
-        error_result = {
-            'status': 'error',
-            'error': f"Unexpected error: {str(e)}"
+            'time_to_first_token_ms': ttft_ms,
+            'tokens': self.token_count,
+            'tokens_per_second': tokens_per_second,
+            'total_ms': round((time.perf_counter() - self._started) * 1000, 1)
         }
-        print(f"Unexpected error sending message to IoT topic: {json.dumps(error_result)}")
-        return error_result
 
+def make_streaming_callback_handler(renderer: StreamingMarkdownRenderer):
+    """Create an agent callback handler that streams text and tool use notices into a renderer.
 
+    Args:
+        renderer: The renderer for this turn's response
 
-@tool
-def house_party_protocol() -> dict:
-    """Nova, initiate House Party Protocol.
+    Returns:
+        A callback handler for Agent.callback_handler
+    """
+    announced_tools = set()
+    # Strands streams events from its own thread, which needs the session's script run context
+    ctx = get_script_run_ctx()
     
-    This tool activates the House Party Protocol from Iron Man 3, where Tony Stark
-    remotely activated his Iron Legion of suits.
+    def streamlit_callback_handler(**kwargs):
+        if ctx is not None and get_script_run_ctx(suppress_warning=True) is None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        if "data" in kwargs:
+            # Append the new chunk to the response
+            renderer.append(kwargs["data"])
+        elif "current_tool_use" in kwargs and kwargs["current_tool_use"].get("name"):
+            tool = kwargs["current_tool_use"]
+            # The tool use is reported on every input delta, announce it once
+            tool_id = tool.get("toolUseId", tool.get("name"))
+            if tool_id not in announced_tools:
+                announced_tools.add(tool_id)
+                renderer.append(f"\n\n*Using tool: {tool.get('name')}*\n\n", force_flush=True)
     
-    Returns:
-        dict: Status of the Iron Legion deployment and suit activation sequence
+    return streamlit_callback_handler
+
+
+def render_command_result(result: dict, queued_message: str):
+    """Show the outcome of a device command button.
+
+    Args:
+        result: The device tool's result
+        queued_message: Shown when the command was queued, formatted with the result's fields
     """
-    try:
-        # Create an IoT client
-        iot_client = boto3.client('iot-data')
+    if result["status"] == "error":
+        st.error(result["error"])
+    elif result["status"] == "debounced":
+        st.info("That command was just queued")
+    else:
+        st.success(queued_message.format(**result))
+
+
+def render_vehicle_detail(vehicle: dict, friendly_date: str, previous_measurements: dict = None):
+    """Render the sensor, position and motion metrics for one vehicle.
+
+    Args:
+        vehicle: A get_vehicle_telemetry style record
+        friendly_date: The vehicle's last updated time, formatted for display
+        previous_measurements: The vehicle's measurements at the previous refresh, shown as deltas
+    """
+    vehicle_name = vehicle.get('vehicle_name', 'Unknown')
+    measurements = vehicle.get('measurements', {})
+    
+    def delta(measurement):
+        # Only metrics that changed since the previous refresh get a delta
+        if not previous_measurements:
+            return None
+        current = measurements.get(measurement)
+        previous = previous_measurements.get(measurement)
+        if current is None or previous is None or np.isnan(previous) or current == previous:
+            return None
+        return round(current - previous, 4)
+    
+    with st.expander(f"Vehicle: {vehicle_name} - Last updated: {friendly_date}", expanded=True):
+        # Sensors section
+        st.subheader("Sensors")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Temperature", f"{measurements.get('temperature', 'N/A')}°C", delta=delta('temperature'))
+        with col2:
+            st.metric("Humidity", f"{measurements.get('humidity', 'N/A')}%", delta=delta('humidity'))
+        with col3:
+            st.metric("Light", f"{measurements.get('light', 'N/A')}", delta=delta('light'))
         
-        # Define topic and payload
-        topic = "my-project-iot-suit-telemetry-suit-telemetry-action"
-        payload = {
-            "action": "house_party_protocol",
-            "message": "Deploying Iron Legion"
-        }
+        # Position section
+        st.subheader("Position")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Latitude", f"{measurements.get('latitude', 'N/A')}", delta=delta('latitude'))
+        with col2:
+            st.metric("Longitude", f"{measurements.get('longitude', 'N/A')}", delta=delta('longitude'))
+        with col3:
+            st.metric("Altitude", f"{measurements.get('altitude', 'N/A')}", delta=delta('altitude'))
+        
+        # Motion section
+        st.subheader("Motion")
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            pitch = measurements.get('pitch', 'N/A')
+            pitch_val = float(pitch) if pitch != 'N/A' else pitch
+            st.metric("Pitch", f"{pitch_val}°" if pitch != 'N/A' else pitch, delta=delta('pitch'))
+        with col2:
+            roll = measurements.get('roll', 'N/A')
+            roll_val = float(roll) if roll != 'N/A' else roll
+            st.metric("Roll", f"{roll_val}°" if roll != 'N/A' else roll, delta=delta('roll'))
+        with col3:
+            x = measurements.get('x', 'N/A')
+            x_val = float(x) if x != 'N/A' else x
+            st.metric("X", x_val, delta=delta('x'))
+        with col4:
+            y = measurements.get('y', 'N/A')
+            y_val = float(y) if y != 'N/A' else y
+            st.metric("Y", y_val, delta=delta('y'))
+        with col5:
+            z = measurements.get('z', 'N/A')
+            z_val = float(z) if z != 'N/A' else z
+            st.metric("Z", z_val, delta=delta('z'))
 
-        # Convert payload to JSON string
-        message_json = json.dumps(payload)
+
+def render_fleet_telemetry(display_timezone: str):
+    """Render the fleet table, map and the selected vehicle's details.
+
+    Runs as a Streamlit fragment, so live refreshes rerun only this region rather than
+    the whole script. Each refresh diffs the fleet against the previous refresh in this
+    session to mark the vehicles that changed and show per-metric deltas.
+
+    Args:
+        display_timezone: The timezone for last updated times
+    """
+    try:
+        store = get_telemetry_store()
+        version = store.version
+        fleet = build_fleet_dataframe(store, version, display_timezone)
+        
+        # Diff against the previous refresh only when new telemetry has arrived
+        diff = st.session_state.get("telemetry_diff")
+        if diff is None or diff['version'] != version:
+            values = fleet[list(TELEMETRY_MEASUREMENTS)].to_numpy()
+            prior = None if diff is None else diff['values']
+            changed = np.ones(len(values), dtype=bool)
+            if prior is not None:
+                # Rows are only ever appended, so existing vehicles keep their position
+                count = min(len(prior), len(values))
+                same = (values[:count] == prior[:count]) | (np.isnan(values[:count]) & np.isnan(prior[:count]))
+                changed[:count] = ~same.all(axis=1)
+            diff = {'version': version, 'values': values, 'prior': prior, 'changed': changed}
+            st.session_state.telemetry_diff = diff
+        changed = diff['changed']
+        
+        st.success(f"Retrieved data for {len(fleet)} vehicles, {int(changed.sum())} changed in the latest update")
+        
+        # Search and sort the whole fleet server-side, then send one page to the browser
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            search = st.text_input("Search vehicles", key="fleet_search")
+        with col2:
+            sort_label = st.selectbox("Sort by", list(FLEET_SORT_COLUMNS), key="fleet_sort")
+        with col3:
+            descending = st.toggle("Descending", key="fleet_sort_descending")
+        
+        view = fleet
+        if search:
+            view = view[view['vehicle_name'].str.contains(search, case=False, regex=False)]
+        view = view.sort_values(FLEET_SORT_COLUMNS[sort_label], ascending=not descending, kind='stable', na_position='last')
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            page_size = st.selectbox("Vehicles per page", FLEET_PAGE_SIZES, key="fleet_page_size")
+        page_count = max(1, -(-len(view) // page_size))
+        # The page lives in session state alone, so it can be kept in range when a search
+        # shrinks the results without the widget also being given a default value
+        if "fleet_page" not in st.session_state:
+            st.session_state.fleet_page = 1
+        elif st.session_state.fleet_page > page_count:
+            st.session_state.fleet_page = page_count
+        with col2:
+            page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, key="fleet_page")
         
-        # Publish the message
-        response = iot_client.publish(
-            topic=topic,
-            qos=1,  # QoS 1 for at least once delivery
-            payload=message_json
+        page_frame = view.iloc[(page - 1) * page_size:page * page_size]
+        page_names = page_frame['vehicle_name'].tolist()
+        st.caption(f"Showing {len(page_frame)} of {len(view)} matching vehicles. Select a row to see its details.")
+        # The table reports its selection as a row position, so the table gets a new key
+        # whenever the vehicles on the page change, and the selection is kept by vehicle name
+        table_key = "fleet_table_" + hashlib.sha256("\n".join(page_names).encode()).hexdigest()[:16]
+        selection = st.dataframe(
+            page_frame.drop(columns=['last_updated_ms']).assign(changed=changed[page_frame.index]),
+            hide_index=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key=table_key
         )
+        selected_rows = selection.selection.rows
+        previous_key, previous_rows = st.session_state.get("fleet_table_selection", (None, []))
+        if selected_rows:
+            st.session_state.fleet_selected_vehicle = page_names[selected_rows[0]]
+        elif table_key == previous_key and previous_rows:
+            # The same table had a row selected on the previous run: the user cleared it
+            st.session_state.fleet_selected_vehicle = None
+        st.session_state.fleet_table_selection = (table_key, list(selected_rows))
+        if st.session_state.get("fleet_selected_vehicle") not in page_names:
+            st.session_state.fleet_selected_vehicle = None
         
-        return {
-            'status': 'success',
-            'message': "House Party Protocol activated: Iron Legion deployed",
-            'topic': topic,
-            'suits_activated': "Mark 15-42 online and responding",
-            'payload': payload
-        }
+        # Plot every matching vehicle in a single map element
+        positions = view[['latitude', 'longitude']].dropna()
+        if len(positions):
+            st.map(positions, latitude='latitude', longitude='longitude')
+        
+        # Render the detail panel only for the selected vehicle
+        selected_name = st.session_state.fleet_selected_vehicle
+        if selected_name is not None:
+            selected = page_frame.iloc[page_names.index(selected_name)]
+            vehicle = store.latest(selected_name)
+            if vehicle is not None:
+                # Show how each metric moved since the previous refresh
+                prior = diff['prior']
+                previous_measurements = None
+                if prior is not None and selected.name < len(prior):
+                    previous_measurements = dict(zip(TELEMETRY_MEASUREMENTS, prior[selected.name]))
+                render_vehicle_detail(vehicle, selected['last_updated'], previous_measurements)
         
-    except ClientError as e:
-        error_result = {
-            'status': 'error',
-            'error': str(e),
-            'topic': topic if 'topic' in locals() else 'unknown'
-        }
-        print(f"Error sending House Party Protocol message: {json.dumps(error_result)}")
-        return error_result
     except Exception as e:
-        error_result = {
-            'status': 'error',
-            'error': f"Unexpected error: {str(e)}"
-        }
-        print(f"Unexpected error sending House Party Protocol message: {json.dumps(error_result)}")
-        return error_result
+        st.error(f"Error fetching telemetry data: {e}")
+
+
+def prewarm():
+    """Load the deferred imports and clients so the first chat message or command doesn't wait for them."""
+    try:
+        with get_startup_profile().measure("startup", "prewarm"):
+            get_strands_tools(AGENT_TOOLS)
+            get_bedrock_model(AGENT_MODEL_ID)
+            # Also publishes any commands left in the outbox's SQLite queue
+            get_command_outbox()
+            pd.DataFrame
+        if STARTUP_PROFILE_FILE:
+            get_startup_profile().export(STARTUP_PROFILE_FILE)
+    except Exception:
+        logger.exception("Error pre-warming")
+
+
+@st.cache_resource
+def start_prewarm() -> threading.Thread:
+    """Start pre-warming on a background thread, once per process."""
+    thread = threading.Thread(target=prewarm, name="startup-prewarm", daemon=True)
+    # prewarm() calls st.cache_resource getters, which expect a script run context
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    return thread
 
-# Initialize the Strands agent with all tools
-agent = Agent(
-    model="us.amazon.nova-pro-v1:0",
-    tools=[
-        get_vehicle_telemetry, 
-        send_cat_feeder_message, 
-        sleep_seconds,
-        set_iron_man_mark3_helmet_action,
-        control_cat_feeder_iot,
-        house_party_protocol
-    ]
-)
 
-# Set page title and Streamlit UI
-st.set_page_config(page_title="AWS Sydney Summit 2025 - Building IoT solutions on AWS")
-st.title("AWS Sydney Summit 2025 - Building IoT solutions on AWS")
-st.write("send 'tools' as a message to start")
+def main():
+    """Render the Streamlit UI, run by `streamlit run app.py`."""
+    # Set page title and Streamlit UI
+    st.set_page_config(page_title="AWS Sydney Summit 2025 - Building IoT solutions on AWS")
+    st.title("AWS Sydney Summit 2025 - Building IoT solutions on AWS")
+    st.write("send 'tools' as a message to start")
 
-# Create tabs for different functionalities
-tab1, tab2, tab3, tab4 = st.tabs(["Control devices using Strands Agent", "Cat Feeder Control", "Vehicle Telemetry", "Iron Man Helmet Control"])
+    # Create tabs for different functionalities
+    tab1, tab2, tab3, tab4 = st.tabs(["Control devices using Strands Agent", "Cat Feeder Control", "Vehicle Telemetry", "Iron Man Helmet Control"])
 
-# Tab 1: Control devices using Strands Agent
-with tab1:
+    # Tab 1: Control devices using Strands Agent
+    with tab1:
         st.header("Control devices using Strands Agent")
         
         # Initialize session state for messages if it doesn't exist
@@ -312,9 +3018,17 @@ with tab1:
         # Chat input at the bottom (this will be displayed at the bottom of the page)
         user_input = st.chat_input("Your message:", key="chat_input")
         
-        # Display chat history in the container above the input
+        # Display the latest page of chat history above the input, older pages on request
         with chat_col:
-            for message in st.session_state.messages:
+            visible_count = st.session_state.get("chat_history_visible", CHAT_HISTORY_PAGE_SIZE)
+            hidden_count = max(0, len(st.session_state.messages) - visible_count)
+            if hidden_count:
+                st.button(
+                    f"Show earlier messages ({hidden_count} hidden)",
+                    key="chat_history_more_btn",
+                    on_click=lambda: st.session_state.update(chat_history_visible=visible_count + CHAT_HISTORY_PAGE_SIZE)
+                )
+            for message in st.session_state.messages[hidden_count:]:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
         
@@ -332,33 +3046,95 @@ with tab1:
                 with st.chat_message("assistant"):
                     response_placeholder = st.empty()
                     
-                    # Reset response for this interaction
-                    st.session_state.response = ""
+                    # Buffer the streamed response and redraw it at a bounded rate
+                    renderer = StreamingMarkdownRenderer(response_placeholder)
+                    streamlit_callback_handler = make_streaming_callback_handler(renderer)
                     
-                    # Define a callback handler for streaming
-                    def streamlit_callback_handler(**kwargs):
-                        if "data" in kwargs:
-                            # Append the new chunk to the response
-                            st.session_state.response += kwargs["data"]
-                            # Update the placeholder with the current response
-                            response_placeholder.markdown(st.session_state.response)
-                        elif "current_tool_use" in kwargs and kwargs["current_tool_use"].get("name"):
-                            tool = kwargs["current_tool_use"]
-                            tool_info = f"\n\n*Using tool: {tool.get('name')}*\n\n"
-                            st.session_state.response += tool_info
-                            response_placeholder.markdown(st.session_state.response)
+                    # Simple commands are answered by calling the tool directly, then repeated
+                    # read-only questions from the cache, and everything else by the agent
+                    routed = get_intent_router().route(user_input) if FAST_PATH_ROUTING else None
+                    response_cache = get_response_cache()
+                    cache_key = response_cache.key(AGENT_MODEL_ID, user_input, st.session_state.messages[:-1])
+                    cached_text = response_cache.get(cache_key) if routed is None else None
                     
-                    # Set the callback handler for the agent
-                    agent.callback_handler = streamlit_callback_handler
-                    
-                    # Process the user's question
-                    result = agent(user_input)
-                    
-                    # Add assistant response to chat history
-                    st.session_state.messages.append({"role": "assistant", "content": st.session_state.response})
+                    if routed is not None:
+                        renderer.append(routed['text'], force_flush=True)
+                        st.session_state.last_turn_metrics = {**renderer.finish(), 'cached': False, 'fast_path': routed['intent']}
+                        st.caption(f"Answered without the model ({routed['intent']}, {routed['duration_ms']:.0f} ms)")
+                        remember_exchange(user_input, routed['text'])
+                        st.session_state.messages.append({"role": "assistant", "content": routed['text']})
+                    elif cached_text is not None:
+                        # Repeated read-only question: answer without calling the model
+                        renderer.append(cached_text, force_flush=True)
+                        st.session_state.last_turn_metrics = {**renderer.finish(), 'cached': True}
+                        st.caption("Answered from cache")
+                        
+                        # Keep the agent's conversation in step with the chat history
+                        remember_exchange(user_input, cached_text)
+                        st.session_state.messages.append({"role": "assistant", "content": cached_text})
+                    else:
+                        agent = get_session_agent()
+                        
+                        # Run the user's question on this session's agent via the shared worker pool
+                        add_pending_messages(agent)
+                        tool_calls_before = get_tool_call_counts(agent)
+                        usage_before = dict(agent.event_loop_metrics.accumulated_usage)
+                        try:
+                            future = get_agent_executor().submit(agent, user_input, streamlit_callback_handler)
+                        except AgentBusyError as e:
+                            st.warning(f"{e}, please try again in a moment.")
+                            future = None
+                        
+                        result = None
+                        if future is not None:
+                            try:
+                                result = future.result(timeout=AGENT_TURN_TIMEOUT_SECONDS)
+                            except FutureTimeoutError:
+                                # The turn keeps running and the session's next message is rejected until it ends
+                                logger.warning("Agent turn timed out", extra={'timeout_seconds': AGENT_TURN_TIMEOUT_SECONDS})
+                                st.error(f"The agent did not answer within {AGENT_TURN_TIMEOUT_SECONDS:.0f} seconds, "
+                                         "it is still working on it, please try again in a moment.")
+                            except Exception as e:
+                                logger.exception("Agent turn failed")
+                                st.error(f"The agent could not answer: {e}")
+                        
+                        if result is not None:
+                            usage = agent.event_loop_metrics.accumulated_usage
+                            
+                            # Draw the complete response and report streaming and token metrics
+                            st.session_state.last_turn_metrics = {
+                                **renderer.finish(),
+                                'cached': False,
+                                'prompt_tokens': usage['inputTokens'] - usage_before['inputTokens'],
+                                'output_tokens': usage['outputTokens'] - usage_before['outputTokens'],
+                                'history_messages': len(agent.messages),
+                                'history_tokens_estimate': estimate_tokens(agent.messages),
+                                'history_summaries': agent.conversation_manager.summaries
+                            }
+                            st.caption(
+                                f"Time to first token: {st.session_state.last_turn_metrics['time_to_first_token_ms']} ms · "
+                                f"{st.session_state.last_turn_metrics['tokens_per_second']} tokens/s · "
+                                f"{st.session_state.last_turn_metrics['prompt_tokens']} prompt tokens"
+                            )
+                            
+                            get_intent_router().record_agent_turn(st.session_state.last_turn_metrics['total_ms'])
+                            
+                            # Cache the answer if the turn only read data
+                            if result.stop_reason == "end_turn":
+                                tool_calls = get_tool_call_counts(agent)
+                                response_cache.store(
+                                    cache_key,
+                                    str(result).strip(),
+                                    {name for name, count in tool_calls.items() if count > tool_calls_before.get(name, 0)},
+                                    st.session_state.last_turn_metrics['total_ms'],
+                                    usage['totalTokens'] - usage_before['totalTokens']
+                                )
+                            
+                            # Add assistant response to chat history
+                            st.session_state.messages.append({"role": "assistant", "content": renderer.text})
 
-# Tab 2: Cat Feeder Control
-with tab2:
+    # Tab 2: Cat Feeder Control
+    with tab2:
         st.header("Cat Feeder Control")
         
         col1, col2, col3 = st.columns(3)
@@ -367,120 +3143,100 @@ with tab2:
             if st.button("Forward", key="forward_btn"):
                 with st.spinner("Sending command..."):
                     result = send_cat_feeder_message("forward")
-                    st.success("Cat feeder moving forward!")
+                    render_command_result(result, "Forward command {command_id} queued for the cat feeder")
         
         with col2:
             if st.button("Stop", key="stop_btn"):
                 with st.spinner("Sending command..."):
+                    # A queued stop also cancels the stop scheduled by a timed feed
                     result = send_cat_feeder_message("stop")
-                    st.success("Cat feeder stopped!")
+                    render_command_result(result, "Stop command {command_id} queued for the cat feeder")
         
         with col3:
             if st.button("Backward", key="backward_btn"):
                 with st.spinner("Sending command..."):
                     result = send_cat_feeder_message("backward")
-                    st.success("Cat feeder moving backward!")
+                    render_command_result(result, "Backward command {command_id} queued for the cat feeder")
         
         # Timed feeding
         st.subheader("Timed Feeding")
         seconds = st.slider("Feed duration (seconds)", 1, 10, 5, key="feed_duration_slider")
         
         if st.button(f"Feed for {seconds} seconds", key="timed_feed_btn"):
-            with st.spinner(f"Feeding for {seconds} seconds..."):
-                # Start feeding
-                send_cat_feeder_message("forward")
-                # Wait for specified duration
-                sleep_seconds(seconds)
-                # Stop feeding
-                send_cat_feeder_message("stop")
-                st.success(f"Kitty has been fed for {seconds} seconds! 😺")
-
-# Tab 3: Vehicle Telemetry
-with tab3:
+            with st.spinner("Sending command..."):
+                # Start feeding, the stop is sent by the command scheduler
+                result = start_timed_feed(seconds)
+                render_command_result(result, "Feed command queued, the feeder is scheduled to stop in {stops_in_seconds:.0f} seconds 😺")
+
+    # Tab 3: Vehicle Telemetry
+    with tab3:
         st.header("Vehicle Telemetry Data")
         
+        timezone_options = sorted({TELEMETRY_DISPLAY_TIMEZONE, "Australia/Sydney", "Pacific/Auckland", "UTC"})
+        display_timezone = st.selectbox(
+            "Display timezone",
+            timezone_options,
+            index=timezone_options.index(TELEMETRY_DISPLAY_TIMEZONE),
+            key="display_timezone_select"
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            live_updates = st.toggle("Live updates", key="telemetry_live_toggle")
+        with col2:
+            refresh_seconds = st.slider(
+                "Refresh every (seconds)", 1, 60, TELEMETRY_REFRESH_SECONDS,
+                key="telemetry_refresh_slider", disabled=not live_updates
+            )
+        
         if st.button("Fetch Telemetry Data", key="fetch_telemetry_btn"):
-            with st.spinner("Fetching data..."):
+            st.session_state.telemetry_loaded = True
+        
+        if live_updates or st.session_state.get("telemetry_loaded"):
+            # In live mode only the telemetry fragment reruns on the interval, not the whole app
+            telemetry_fragment = st.fragment(run_every=refresh_seconds if live_updates else None)(render_fleet_telemetry)
+            telemetry_fragment(display_timezone)
+        
+        # Fleet-wide analytics
+        st.subheader("Fleet Analytics")
+        col1, col2 = st.columns(2)
+        with col1:
+            z_threshold = st.number_input("Anomaly z-score threshold", 1.0, 10.0, TELEMETRY_ANOMALY_Z_THRESHOLD, 0.5, key="z_threshold_input")
+        with col2:
+            tilt_threshold = st.number_input("Tilt threshold (degrees)", 1.0, 90.0, TELEMETRY_TILT_THRESHOLD_DEGREES, 1.0, key="tilt_threshold_input")
+        
+        if st.button("Analyze Fleet", key="analyze_fleet_btn"):
+            with st.spinner("Analyzing fleet..."):
                 try:
-                    telemetry_data = get_vehicle_telemetry()
-                    st.success(f"Retrieved data for {len(telemetry_data)} vehicles")
+                    analytics = compute_fleet_analytics(get_telemetry_store())
+                    anomalies = find_fleet_anomalies(analytics, z_threshold, tilt_threshold)
                     
-                    # Display telemetry data
-                    for vehicle in telemetry_data:
-                        vehicle_name = vehicle.get('vehicle_name', 'Unknown')
-                        measurements = vehicle.get('measurements', {})
-                        last_updated = vehicle.get('last_updated', 'Unknown time')
-                        
-                        # Format the timestamp to a more friendly format (convert from UTC to New Zealand time)
-                        try:
-                            from datetime import datetime
-                            import pytz
-                            
-                            sydney_timezone = pytz.timezone('Australia/Sydney')
-                            
-                            if isinstance(last_updated, str):
-                                # Parse the UTC timestamp
-                                dt = datetime.fromisoformat(last_updated.replace('000000', ''))
-                                # Make it timezone aware (UTC)
-                                dt_utc = pytz.utc.localize(dt) if dt.tzinfo is None else dt
-                                # Convert to Sydney time
-                                dt_sydney = dt_utc.astimezone(sydney_timezone)
-                                friendly_date = dt_sydney.strftime("%B %d, %Y at %I:%M:%S %p (Sydney time)")
-                            else:
-                                friendly_date = "Unknown time"
-                        except:
-                            friendly_date = last_updated
-                            
-                        with st.expander(f"Vehicle: {vehicle_name} - Last updated: {friendly_date}", expanded=True):
-                            # Sensors section
-                            st.subheader("Sensors")
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("Temperature", f"{measurements.get('temperature', 'N/A')}°C")
-                            with col2:
-                                st.metric("Humidity", f"{measurements.get('humidity', 'N/A')}%")
-                            with col3:
-                                st.metric("Light", f"{measurements.get('light', 'N/A')}")
-                            
-                            # Position section
-                            st.subheader("Position")
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("Latitude", f"{measurements.get('latitude', 'N/A')}")
-                            with col2:
-                                st.metric("Longitude", f"{measurements.get('longitude', 'N/A')}")
-                            with col3:
-                                st.metric("Altitude", f"{measurements.get('altitude', 'N/A')}")
-                            
-                            # Motion section
-                            st.subheader("Motion")
-                            col1, col2, col3, col4, col5 = st.columns(5)
-                            with col1:
-                                pitch = measurements.get('pitch', 'N/A')
-                                pitch_val = float(pitch) if pitch != 'N/A' else pitch
-                                st.metric("Pitch", f"{pitch_val}°" if pitch != 'N/A' else pitch)
-                            with col2:
-                                roll = measurements.get('roll', 'N/A')
-                                roll_val = float(roll) if roll != 'N/A' else roll
-                                st.metric("Roll", f"{roll_val}°" if roll != 'N/A' else roll)
-                            with col3:
-                                x = measurements.get('x', 'N/A')
-                                x_val = float(x) if x != 'N/A' else x
-                                st.metric("X", x_val)
-                            with col4:
-                                y = measurements.get('y', 'N/A')
-                                y_val = float(y) if y != 'N/A' else y
-                                st.metric("Y", y_val)
-                            with col5:
-                                z = measurements.get('z', 'N/A')
-                                z_val = float(z) if z != 'N/A' else z
-                                st.metric("Z", z_val)
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Vehicles", len(analytics['names']))
+                    with col2:
+                        st.metric("Tilting", sum(1 for a in anomalies if a['tilting']))
+                    with col3:
+                        st.metric("Flagged", len(anomalies))
+                    st.caption(f"Computed in {analytics['computed_ms']} ms for telemetry snapshot {analytics['version']}")
                     
+                    if anomalies:
+                        st.dataframe([
+                            {
+                                'Vehicle': a['vehicle_name'],
+                                'Tilt (°)': a['tilt_degrees'],
+                                'Acceleration': a['acceleration'],
+                                'Anomalous measurements': ', '.join(a['anomalous_measurements'])
+                            }
+                            for a in anomalies
+                        ], hide_index=True)
+                    else:
+                        st.success("No tilting or anomalous vehicles")
                 except Exception as e:
-                    st.error(f"Error fetching telemetry data: {e}")
+                    st.error(f"Error analyzing telemetry data: {e}")
 
-# Tab 4: Iron Man Helmet Control
-with tab4:
+    # Tab 4: Iron Man Helmet Control
+    with tab4:
         st.header("Iron Man Mark 3 Helmet Control")
         
         # Faceplate control
@@ -491,14 +3247,14 @@ with tab4:
             if st.button("Open Faceplate", key="open_faceplate_btn"):
                 with st.spinner("Sending command..."):
                     result = set_iron_man_mark3_helmet_action("face_open", "on")
-                    st.success("Command sent successfully")
+                    render_command_result(result, "Command {command_id} queued for the helmet")
                     st.write(result)
         
         with col2:
             if st.button("Close Faceplate", key="close_faceplate_btn"):
                 with st.spinner("Sending command..."):
                     result = set_iron_man_mark3_helmet_action("face_close", "on")
-                    st.success("Command sent successfully")
+                    render_command_result(result, "Command {command_id} queued for the helmet")
                     st.write(result)
         
         # Eyes control
@@ -511,7 +3267,7 @@ with tab4:
                     # Get current faceplate state or default to closed
                     faceplate_state = "face_close"  # Default
                     result = set_iron_man_mark3_helmet_action(faceplate_state, "on")
-                    st.success("Command sent successfully")
+                    render_command_result(result, "Command {command_id} queued for the helmet")
                     st.write(result)
         
         with col2:
@@ -520,15 +3276,72 @@ with tab4:
                     # Get current faceplate state or default to closed
                     faceplate_state = "face_close"  # Default
                     result = set_iron_man_mark3_helmet_action(faceplate_state, "off")
-                    st.success("Command sent successfully")
+                    render_command_result(result, "Command {command_id} queued for the helmet")
                     st.write(result)
         
 
+    # Sidebar: latency of the shared subsystems
+    with st.sidebar:
+        st.header("Performance")
+        st.subheader("IoT publisher")
+        if get_startup_profile().has("client", "iot-data"):
+            st.json({**get_iot_publisher().stats(), 'debounced': get_command_debouncer().suppressed})
+            st.subheader("Command outbox")
+            st.json(get_command_outbox().stats())
+        else:
+            st.caption("IoT publisher is created on the first command")
+        
+        st.subheader("Agent")
+        agent_cache = st.session_state.get("agent_cache")
+        if agent_cache is None:
+            st.caption("Agent is built on the first chat message")
+        else:
+            st.json({
+                'model_id': agent_cache["key"][0],
+                'build_ms': round(agent_cache["build_ms"], 1),
+                'reuses': agent_cache["reuses"]
+            })
+        
+        st.subheader("Agent executor")
+        st.json(get_agent_executor().stats())
+        
+        st.subheader("Tool selection")
+        st.json(get_tool_selector(DEVICE_REGISTRY.version).stats())
+        
+        st.subheader("Fast path")
+        st.json(get_intent_router().stats())
+        
+        st.subheader("Caches")
+        st.json({'responses': get_response_cache().stats(), 'tool_results': get_tool_result_cache().stats()})
+        
+        st.subheader("Last chat turn")
+        st.json(st.session_state.get("last_turn_metrics", {}))
+        
+        st.subheader("Scheduled commands")
+        st.json(get_command_scheduler().pending())
+        
+        st.subheader("Startup")
+        st.json(get_startup_profile().report())
+        
+        st.subheader("Metrics")
+        st.json(get_metrics().snapshot(), expanded=False)
 
-# Add instructions at the bottom
-st.markdown("---")
-st.markdown("""
+    # Add instructions at the bottom
+    st.markdown("---")
+    st.markdown("""
 ### How to run this app:
 1. Install required packages: `pip install streamlit strands-agents boto3`
 2. Run the app: `streamlit run streamlit_agent_summit.py`
-""")
\ No newline at end of file
+""")
+
+    start_metrics_exporters()
+
+    # The page is drawn; load the deferred imports and clients in the background
+    get_startup_profile().record("startup", "first script run", (time.perf_counter() - MODULE_LOAD_STARTED) * 1000)
+    if STARTUP_PREWARM:
+        start_prewarm()
+
+
+# Streamlit runs this script as __main__; importing it (e.g. from benchmark.py) skips the UI
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""Offline benchmark for the demo app, no AWS credentials required.
+
+Runs the tool functions, the Strands agent loop and the chat streaming callback from
+app.py against local stand-ins: a fake IoT publisher with configurable publish latency
+and a scripted model that streams tool calls and tokens with configurable latency.
+Concurrent users are simulated with one thread per user, sharing app.AgentExecutor
+like browser sessions do.
+
+Usage:
+    python benchmark.py --users 20 --turns 5
+    python benchmark.py --json bench_output.json --fail-p95-ms 5000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+# The app reads AWS settings at import time; nothing here talks to AWS
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+# Every tool call and turn is logged at INFO; keep the report readable
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import streamlit.logger
+
+# Streamlit warns about every cache call made outside `streamlit run`
+streamlit.logger.set_log_level("error")
+
+import app
+from botocore.exceptions import ClientError
+from strands import Agent
+from strands.models import Model
+
+
+# Prompts a simulated booth visitor sends, and the tool calls the scripted model makes for each
+HELMET_OPEN = ("set_iron_man_mark3_helmet_action", {"faceplate_state": "face_open", "eyes_state": "on"})
+FEEDER_FORWARD = ("control_cat_feeder_iot", {"action": "forward"})
+SCRIPT = [
+    ("tools", []),
+    ("show vehicle telemetry", [("summarize_vehicle_telemetry", {})]),
+    ("which vehicles are tilting", [("analyze_fleet_telemetry", {"limit": 5})]),
+    ("open the helmet and start the cat feeder", [HELMET_OPEN, FEEDER_FORWARD]),
+    ("open the helmet", [HELMET_OPEN]),
+    ("start the cat feeder", [FEEDER_FORWARD]),
+    ("stop the cat feeder", [("control_cat_feeder_iot", {"action": "stop"})]),
+    ("house party protocol", [("house_party_protocol", {})])
+]
+
+
+class FakeIoTPublisher:
+    """Stands in for app.IoTPublisher, sleeping for the configured latency instead of calling IoT Core.
+
+    A `throttle_rate` fraction of publishes fail with IoT Core's ThrottlingException.
+    """
+
+    def __init__(self, latency_ms: float = 20.0, jitter_ms: float = 5.0, throttle_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.throttled = 0
+        self.pool_size = app.IOT_PUBLISH_POOL_SIZE
+        self._lock = threading.Lock()
+        self.messages = []
+
+    def publish(self, topic: str, payload, qos: int = 1) -> tuple:
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        start = time.perf_counter()
+        time.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+        if random.random() < self.throttle_rate:
+            with self._lock:
+                self.throttled += 1
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'Publish')
+        with self._lock:
+            self.messages.append((topic, payload))
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}, (time.perf_counter() - start) * 1000
+
+    def stats(self) -> dict:
+        return {'publishes': len(self.messages)}
+
+
+class ScriptedModel(Model):
+    """A Strands model that follows SCRIPT instead of calling Bedrock.
+
+    For a prompt matching a SCRIPT entry with tools, the first response is those tool
+    calls; once the tool results are in the conversation, or for prompts without tools,
+    it streams `tokens` text tokens. Latencies are applied before the first event and
+    between tokens.
+    """
+
+    def __init__(self, first_token_ms: float = 300.0, token_ms: float = 15.0, tokens: int = 60):
+        self.config = {'model_id': 'scripted', 'first_token_ms': first_token_ms, 'token_ms': token_ms, 'tokens': tokens}
+
+    def update_config(self, **model_config):
+        self.config.update(model_config)
+
+    def get_config(self):
+        return self.config
+
+    async def structured_output(self, output_model, prompt, system_prompt=None, **kwargs):
+        raise NotImplementedError("ScriptedModel does not support structured output")
+        yield
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        last_content = messages[-1]['content']
+        prompt = " ".join(block['text'] for block in last_content if 'text' in block).lower()
+        tool_names = {spec['name'] for spec in tool_specs or []}
+        # The prompt size grows with the history and the tool specs sent, as it would on Bedrock
+        input_tokens = app.estimate_tokens(messages) + app.estimate_tokens(tool_specs or [])
+
+        await asyncio.sleep(self.config['first_token_ms'] / 1000)
+        yield {"messageStart": {"role": "assistant"}}
+
+        for pattern, tool_calls in SCRIPT:
+            if tool_calls and all(name in tool_names for name, _ in tool_calls) and re.search(pattern, prompt):
+                for tool_name, tool_input in tool_calls:
+                    yield {"contentBlockStart": {"start": {"toolUse": {"toolUseId": f"tool-{random.getrandbits(32)}", "name": tool_name}}}}
+                    yield {"contentBlockDelta": {"delta": {"toolUse": {"input": json.dumps(tool_input)}}}}
+                    yield {"contentBlockStop": {}}
+                yield {"messageStop": {"stopReason": "tool_use"}}
+                yield {"metadata": {"usage": {"inputTokens": input_tokens, "outputTokens": 20, "totalTokens": input_tokens + 20}, "metrics": {"latencyMs": 0}}}
+                return
+
+        yield {"contentBlockStart": {"start": {}}}
+        for index in range(self.config['tokens']):
+            await asyncio.sleep(self.config['token_ms'] / 1000)
+            yield {"contentBlockDelta": {"delta": {"text": f"token{index} "}}}
+        yield {"contentBlockStop": {}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        yield {"metadata": {"usage": {"inputTokens": input_tokens, "outputTokens": self.config['tokens'], "totalTokens": input_tokens + self.config['tokens']}, "metrics": {"latencyMs": 0}}}
+
+
+class CountingPlaceholder:
+    """Stands in for st.empty(), counting redraws and the bytes they would send to the browser."""
+
+    def __init__(self):
+        self.redraws = 0
+        self.bytes_sent = 0
+
+    def markdown(self, text: str):
+        self.redraws += 1
+        self.bytes_sent += len(text.encode())
+
+
+def percentiles(samples: list) -> dict:
+    """Return count, p50, p95, p99 and max of a list of millisecond samples."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 2)
+
+    return {'count': len(ordered), 'p50_ms': pick(50), 'p95_ms': pick(95), 'p99_ms': pick(99), 'max_ms': round(ordered[-1], 2)}
+
+
+def make_outbox(publisher, debouncer=None, db_path: str = ""):
+    """Create a command outbox with the app's OUTBOX_* settings around a stand-in publisher."""
+    return app.CommandOutbox(
+        publisher, app.get_metrics(), debouncer,
+        account_rate=app.OUTBOX_ACCOUNT_RATE, account_burst=app.OUTBOX_ACCOUNT_BURST,
+        topic_rate=app.OUTBOX_TOPIC_RATE, topic_burst=app.OUTBOX_TOPIC_BURST,
+        workers=app.OUTBOX_WORKERS, max_attempts=app.OUTBOX_MAX_ATTEMPTS,
+        retry_base_seconds=app.OUTBOX_RETRY_BASE_SECONDS, retry_max_seconds=app.OUTBOX_RETRY_MAX_SECONDS,
+        db_path=db_path, status_history=app.OUTBOX_STATUS_HISTORY
+    )
+
+
+def synthetic_measurements(rng: random.Random) -> dict:
+    """Return one plausible vehicle telemetry reading."""
+    return {
+        'temperature': rng.gauss(24, 2), 'humidity': rng.gauss(60, 5), 'light': rng.gauss(850, 50),
+        'latitude': -33.86 + rng.uniform(-0.1, 0.1), 'longitude': 151.2 + rng.uniform(-0.1, 0.1),
+        'altitude': rng.gauss(60, 5), 'pitch': rng.gauss(0, 3), 'roll': rng.gauss(0, 3),
+        'x': rng.gauss(0, 0.05), 'y': rng.gauss(0, 0.05), 'z': rng.gauss(9.8, 0.05)
+    }
+
+
+def install_fakes(publish_latency_ms: float, vehicles: int):
+    """Point the app's shared subsystems at local stand-ins and load a synthetic fleet."""
+    publisher = FakeIoTPublisher(publish_latency_ms)
+    # Benchmark commands repeat on purpose, so nothing is debounced
+    debouncer = app.CommandDebouncer(window_seconds=0)
+    outbox = make_outbox(publisher, debouncer)
+    fan_out = app.FanOutPublisher(outbox, debouncer)
+    app.get_iot_publisher = lambda: publisher
+    app.get_command_debouncer = lambda: debouncer
+    app.get_command_outbox = lambda: outbox
+    app.get_fan_out_publisher = lambda: fan_out
+
+    store = app.TelemetryStore()
+    now_ms = time.time_ns() // 1_000_000
+    rng = random.Random(0)
+    for reading in range(3):
+        for index in range(vehicles):
+            store.ingest(f"Vehicle_{index:05d}", now_ms + reading * 1000, synthetic_measurements(rng))
+    app.get_telemetry_store = lambda: store
+    return publisher
+
+
+def bench_startup() -> dict:
+    """Import the app in a fresh interpreter and return its startup profile, plus the import wall time."""
+    code = (
+        "import json, time; start = time.perf_counter(); import app; "
+        "report = app.get_startup_profile().report(); "
+        "report['import_app_ms'] = round((time.perf_counter() - start) * 1000, 1); "
+        "print(json.dumps(report))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_tools(iterations: int) -> dict:
+    """Call each tool directly and report its latency percentiles and throughput, cold and warm.
+
+    Before each cold call a new telemetry reading arrives, so the store's snapshot and the
+    read-only tool and fleet analytics caches, all keyed by the store version, are rebuilt
+    as they are with live telemetry. Warm calls repeat the call against unchanged
+    telemetry, so read-only tools mostly hit their caches.
+    """
+    calls = {
+        'get_vehicle_telemetry': {},
+        'query_vehicle_telemetry': {'min_values': {'temperature': 26}, 'limit': 20},
+        'summarize_vehicle_telemetry': {},
+        'analyze_fleet_telemetry': {'limit': 10},
+        'control_cat_feeder_iot': {'action': 'forward'},
+        'set_iron_man_mark3_helmet_action': {'faceplate_state': 'face_open', 'eyes_state': 'on'},
+        'house_party_protocol': {}
+    }
+    store = app.get_telemetry_store()
+    rng = random.Random(1)
+    # Readings arrive after the synthetic fleet's, one second apart
+    timestamps_ms = itertools.count(time.time_ns() // 1_000_000 + 10_000, 1000)
+
+    def run(tool, kwargs, cold: bool) -> dict:
+        samples = []
+        for _ in range(iterations):
+            if cold:
+                store.ingest("Vehicle_00000", next(timestamps_ms), synthetic_measurements(rng))
+            call_start = time.perf_counter()
+            tool(**kwargs)
+            samples.append((time.perf_counter() - call_start) * 1000)
+        return {**percentiles(samples), 'calls_per_second': round(1000 * len(samples) / sum(samples), 1)}
+
+    results = {}
+    for name, kwargs in calls.items():
+        tool = getattr(app, name)
+        results[name] = {'cold': run(tool, kwargs, cold=True), 'warm': run(tool, kwargs, cold=False)}
+    return results
+
+
+def bench_streaming(tokens: int) -> dict:
+    """Compare redraws and bytes sent by the buffered renderer with redrawing on every token."""
+    placeholder = CountingPlaceholder()
+    renderer = app.StreamingMarkdownRenderer(placeholder)
+    naive_bytes = 0
+    text_length = 0
+    for index in range(tokens):
+        chunk = f"token{index} "
+        renderer.append(chunk)
+        text_length += len(chunk)
+        naive_bytes += text_length
+    renderer.finish()
+    return {
+        'tokens': tokens,
+        'redraws': placeholder.redraws,
+        'bytes_sent': placeholder.bytes_sent,
+        'bytes_sent_redrawing_every_token': naive_bytes
+    }
+
+
+def bench_outbox(commands: int, devices: int, publish_latency_ms: float, throttle_rate: float, db_path: str = "") -> dict:
+    """Queue bursts of commands for a set of devices against a throttling publisher and time the drain."""
+    publisher = FakeIoTPublisher(publish_latency_ms, throttle_rate=throttle_rate)
+    outbox = make_outbox(publisher, db_path=db_path)
+    start = time.perf_counter()
+    enqueue_ms = []
+    for index in range(commands):
+        # Alternate forward and stop, as visitors mashing the feeder buttons would
+        call_start = time.perf_counter()
+        outbox.enqueue(f"device_{index % devices}", "bench/topic", json.dumps({"action": "forward" if index % 2 else "stop"}))
+        enqueue_ms.append((time.perf_counter() - call_start) * 1000)
+    drained = outbox.drain(timeout_seconds=60)
+    elapsed = time.perf_counter() - start
+    outbox.close()
+    stats = outbox.stats()
+    return {
+        'commands': commands,
+        'devices': devices,
+        'drained': drained,
+        'enqueue_latency': percentiles(enqueue_ms),
+        'drain_seconds': round(elapsed, 2),
+        'published_per_second': round(stats['published'] / elapsed, 1),
+        'throttled': publisher.throttled,
+        **{key: stats[key] for key in ('published', 'coalesced', 'retries', 'failed')}
+    }
+
+
+def run_user(executor, agent, prompts: list, turn_ms: list, ttft_ms: list, tokens_per_second: list, rejected: list):
+    """Simulate one browser session sending its prompts one after another."""
+    for prompt in prompts:
+        renderer = app.StreamingMarkdownRenderer(CountingPlaceholder())
+        callback_handler = app.make_streaming_callback_handler(renderer)
+        start = time.perf_counter()
+        try:
+            future = executor.submit(agent, prompt, callback_handler)
+        except app.AgentBusyError:
+            rejected.append(prompt)
+            continue
+        future.result()
+        turn_ms.append((time.perf_counter() - start) * 1000)
+        metrics = renderer.finish()
+        if metrics['time_to_first_token_ms'] is not None:
+            ttft_ms.append(metrics['time_to_first_token_ms'])
+        if metrics['tokens_per_second'] is not None:
+            tokens_per_second.append(metrics['tokens_per_second'])
+
+
+def bench_agent(users: int, turns: int, model_kwargs: dict, max_workers: int, max_queued: int) -> dict:
+    """Run concurrent simulated users through the agent loop and the shared executor."""
+    # Tool selection as in the app, set AGENT_TOOL_SELECTION=all to compare
+    model = app.make_tool_selecting_model(ScriptedModel(**model_kwargs))
+    executor = app.AgentExecutor(max_workers=max_workers, max_queued=max_queued, metrics=app.get_metrics())
+
+    # Memory per session: one agent and one turn per session, measured with tracemalloc
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    agents = [Agent(model=model, tools=app.get_strands_tools(app.AGENT_TOOLS), callback_handler=None, conversation_manager=app.make_conversation_manager()) for _ in range(users)]
+    for agent in agents:
+        executor.submit(agent, SCRIPT[0][0], lambda **kwargs: None).result()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    memory_per_session_kb = round((used - baseline) / users / 1024, 1)
+
+    turn_ms, ttft_ms, tokens_per_second, rejected = [], [], [], []
+    rng = random.Random(1)
+    threads = []
+    start = time.perf_counter()
+    for agent in agents:
+        prompts = [rng.choice(SCRIPT)[0] for _ in range(turns)]
+        thread = threading.Thread(target=run_user, args=(executor, agent, prompts, turn_ms, ttft_ms, tokens_per_second, rejected))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'users': users,
+        'turns': len(turn_ms),
+        'rejected_turns': len(rejected),
+        'turns_per_second': round(len(turn_ms) / elapsed, 2),
+        'turn_latency': percentiles(turn_ms),
+        'time_to_first_token': percentiles(ttft_ms),
+        'tokens_per_second_p50': round(statistics.median(tokens_per_second), 1) if tokens_per_second else None,
+        'memory_per_session_kb': memory_per_session_kb,
+        'executor': executor.stats()
+    }
+
+
+def bench_fast_path(agent_turn_p50_ms: float) -> dict:
+    """Route every scripted prompt through the fast-path intent router and compare it with an agent turn."""
+    router = app.IntentRouter()
+    samples = []
+    hits = []
+    for prompt, _ in SCRIPT:
+        start = time.perf_counter()
+        routed = router.route(prompt)
+        if routed is not None:
+            samples.append((time.perf_counter() - start) * 1000)
+            hits.append(prompt)
+    return {
+        'prompts': len(SCRIPT),
+        'hits': hits,
+        'hit_rate': round(len(hits) / len(SCRIPT), 3),
+        'latency': percentiles(samples),
+        'est_saved_ms_per_hit': round(agent_turn_p50_ms - statistics.median(samples), 1) if samples and agent_turn_p50_ms else None
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users (default: 10)")
+    parser.add_argument("--turns", type=int, default=5, help="Chat turns per user (default: 5)")
+    parser.add_argument("--tool-iterations", type=int, default=50, help="Direct calls per tool (default: 50)")
+    parser.add_argument("--vehicles", type=int, default=1000, help="Vehicles in the synthetic fleet (default: 1000)")
+    parser.add_argument("--publish-latency-ms", type=float, default=20.0, help="Fake IoT publish latency (default: 20)")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="Scripted model latency before the first event (default: 300)")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="Scripted model latency between tokens (default: 15)")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens in each scripted text response (default: 60)")
+    parser.add_argument("--outbox-commands", type=int, default=2000, help="Commands queued in the outbox benchmark (default: 2000)")
+    parser.add_argument("--throttle-rate", type=float, default=0.1, help="Fraction of outbox benchmark publishes throttled (default: 0.1)")
+    parser.add_argument("--max-workers", type=int, default=app.AGENT_MAX_CONCURRENT_TURNS, help="Agent executor workers")
+    parser.add_argument("--max-queued", type=int, default=1000, help="Agent executor queue limit (default: 1000)")
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    parser.add_argument("--fail-p95-ms", type=float, help="Exit with status 1 if the agent turn p95 latency exceeds this")
+    args = parser.parse_args()
+
+    install_fakes(args.publish_latency_ms, args.vehicles)
+    report = {
+        'settings': vars(args),
+        'startup': bench_startup(),
+        'tools': bench_tools(args.tool_iterations),
+        'streaming': bench_streaming(args.tokens * 10),
+        'outbox': bench_outbox(args.outbox_commands, 50, args.publish_latency_ms, args.throttle_rate),
+        'agent': bench_agent(
+            args.users, args.turns,
+            {'first_token_ms': args.first_token_ms, 'token_ms': args.token_ms, 'tokens': args.tokens},
+            args.max_workers, args.max_queued
+        )
+    }
+    report['fast_path'] = bench_fast_path(report['agent']['turn_latency'].get('p50_ms'))
+    report['tool_selection'] = app.get_tool_selector(app.DEVICE_REGISTRY.version).stats()
+    report['metrics'] = app.get_metrics().snapshot()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    p95 = report['agent']['turn_latency'].get('p95_ms')
+    if args.fail_p95_ms is not None and p95 is not None and p95 > args.fail_p95_ms:
+        print(f"Agent turn p95 latency {p95} ms exceeds {args.fail_p95_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
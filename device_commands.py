@@ -0,0 +1,489 @@
+"""Device command scheduling, debouncing and the rate-limited, retrying command outbox.
+
+Streamlit re-executes app.py on every rerun, redefining its classes, while the scheduler,
+debouncer and outbox live for the whole process in st.cache_resource. Keeping them in
+this module means they are defined once per process, and lets them be tested without
+a Streamlit script run.
+"""
+from __future__ import annotations
+
+import atexit
+import bisect
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger("iot_agent_demo")
+
+
+class CommandScheduler:
+    """Runs deferred device commands, such as the 'stop' after a timed feed, on a background thread.
+
+    Each device has at most one pending command. The scheduler lives for the whole process
+    rather than a browser session, so a queued 'stop' is still published if the session
+    that queued it disconnects, and any pending commands are run immediately on shutdown.
+    """
+
+    def __init__(self, overlap_policy: str = 'merge'):
+        if overlap_policy not in ('merge', 'cancel'):
+            raise ValueError(f"Invalid overlap policy: {overlap_policy}. Must be one of: merge, cancel")
+        self.overlap_policy = overlap_policy
+        self._condition = threading.Condition()
+        self._heap = []
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._thread = threading.Thread(target=self._run, name="command-scheduler", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def schedule(self, device: str, delay_seconds: float, command, *args, policy: str = None) -> float:
+        """Schedule a command to run for a device after a delay.
+
+        Args:
+            device: The device key, at most one command is pending per device
+            delay_seconds: Seconds from now until the command runs
+            command: The callable to run
+            *args: Arguments passed to the command
+            policy: Overrides the scheduler's overlap policy for this call
+
+        Returns:
+            The number of seconds until the device's pending command runs
+        """
+        policy = policy or self.overlap_policy
+        with self._condition:
+            now = time.monotonic()
+            deadline = now + delay_seconds
+            existing = self._pending.get(device)
+            if existing is not None and policy == 'merge':
+                deadline = max(deadline, existing[0])
+            sequence = next(self._sequence)
+            self._pending[device] = (deadline, sequence, command, args)
+            heapq.heappush(self._heap, (deadline, sequence, device))
+            self._condition.notify()
+            return deadline - now
+
+    def cancel(self, device: str) -> bool:
+        """Cancel the pending command for a device, returns True if one was pending."""
+        with self._condition:
+            return self._pending.pop(device, None) is not None
+
+    def pending(self) -> dict:
+        """Return the seconds remaining until each device's pending command runs."""
+        with self._condition:
+            now = time.monotonic()
+            return {device: round(max(0.0, entry[0] - now), 1) for device, entry in self._pending.items()}
+
+    def flush(self):
+        """Run every pending command now, used on shutdown so no device is left running."""
+        with self._condition:
+            entries = list(self._pending.items())
+            self._pending.clear()
+            self._heap.clear()
+        for device, (_, _, command, args) in entries:
+            self._execute(device, command, args)
+
+    def _next_due(self):
+        with self._condition:
+            while True:
+                # Drop heap entries that were cancelled or replaced
+                while self._heap:
+                    deadline, sequence, device = self._heap[0]
+                    entry = self._pending.get(device)
+                    if entry is not None and entry[1] == sequence:
+                        break
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                timeout = self._heap[0][0] - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+
+                _, _, device = heapq.heappop(self._heap)
+                _, _, command, args = self._pending.pop(device)
+                return device, command, args
+
+    def _run(self):
+        while True:
+            device, command, args = self._next_due()
+            self._execute(device, command, args)
+
+    def _execute(self, device, command, args):
+        try:
+            command(*args)
+        except Exception:
+            logger.exception("Error running scheduled command", extra={'device': device})
+
+
+class CommandDebouncer:
+    """Suppresses a command that repeats the last one sent to the same device within a short window.
+
+    Only an exact repeat of the device's most recent command is dropped, so mashing
+    Forward sends it once, while Forward, Stop, Forward still sends all three.
+    """
+
+    def __init__(self, window_seconds: float = 1.0):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._last_sent = {}
+        self.suppressed = 0
+
+    def should_send(self, device: str, topic: str, message_json: str) -> bool:
+        """Return False if this exact command was just queued for the device, otherwise record it and return True."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_sent.get((device, topic))
+            if last is not None and last[0] == message_json and now - last[1] < self.window_seconds:
+                self.suppressed += 1
+                return False
+            self._last_sent[(device, topic)] = (message_json, now)
+            return True
+
+    def forget(self, device: str, topic: str, message_json: str):
+        """Forget a device's last command after its publish failed, so a retry isn't suppressed.
+
+        Nothing is forgotten if a different command has been recorded for the device since.
+        """
+        with self._lock:
+            last = self._last_sent.get((device, topic))
+            if last is not None and last[0] == message_json:
+                del self._last_sent[(device, topic)]
+
+
+class TokenBucket:
+    """A token bucket allowing `rate` operations per second with bursts of up to `burst`.
+
+    Not thread-safe; CommandOutbox only uses it while holding its lock.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        # A bucket holding less than one token would never admit an operation
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid token bucket: rate {rate} must be positive and burst {burst} at least 1")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Return the seconds until a token is available, 0 if one is available now."""
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self, now: float):
+        """Take a token; call only after wait_time() returned 0."""
+        self._refill(now)
+        self._tokens -= 1
+
+
+# IoT Core error codes worth retrying: throttling and transient service errors
+RETRYABLE_ERROR_CODES = {'ThrottlingException', 'ServiceUnavailableException', 'InternalFailureException', 'RequestTimeoutException'}
+
+
+def is_retryable_publish_error(error: Exception) -> bool:
+    """Return True if a failed publish may succeed if tried again."""
+    # Imported here so importing this module doesn't load botocore, which any failed publish has already loaded
+    from botocore import exceptions as botocore_exceptions
+
+    if isinstance(error, botocore_exceptions.ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+    return isinstance(error, (botocore_exceptions.ConnectionError, botocore_exceptions.HTTPClientError))
+
+
+class CommandOutbox:
+    """Queues device commands and publishes them on worker threads, within IoT Core's limits.
+
+    Tools enqueue a command and return at once. Workers publish commands oldest first,
+    taking a token from the account-wide bucket and the command's topic bucket for each
+    publish, so a burst of commands is smoothed out instead of being throttled by IoT
+    Core. Throttled and transient failures are retried with exponential backoff and full
+    jitter, up to `max_attempts` publishes.
+
+    Each device and topic has at most one queued command: a new command replaces a queued
+    one that hasn't been published yet, so a queued 'forward' followed by 'stop' only
+    sends 'stop'. Commands for the same device and topic are published one at a time, in
+    order. With `db_path` set, queued commands are kept in SQLite and published after a
+    restart.
+
+    `publisher` is anything with the IoTPublisher publish(topic, payload, qos) method,
+    and queue counts and publish delays are recorded in `metrics`, the app's
+    MetricsRegistry.
+    """
+
+    def __init__(self, publisher, metrics, debouncer: CommandDebouncer = None,
+                 account_rate: float = 200, account_burst: float = 100,
+                 topic_rate: float = 50, topic_burst: float = 50,
+                 workers: int = 10, max_attempts: int = 5,
+                 retry_base_seconds: float = 0.2, retry_max_seconds: float = 10,
+                 db_path: str = "", status_history: int = 10000):
+        self._publisher = publisher
+        self._debouncer = debouncer
+        self._account_bucket = TokenBucket(account_rate, account_burst)
+        self._topic_rate = topic_rate
+        self._topic_burst = topic_burst
+        self._topic_buckets = {}
+        # Topic buckets are created on a topic's first publish, so check their settings now
+        TokenBucket(topic_rate, topic_burst)
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.status_history = status_history
+        self._metrics = metrics
+
+        self._condition = threading.Condition()
+        self._pending = OrderedDict()  # (device, topic) -> command, oldest first
+        self._in_flight = set()
+        self._next_id = 1
+        self._closed = False
+        self._published_at = deque(maxlen=10000)
+        self._outcomes = OrderedDict()  # command ID -> status of the most recent commands
+        self._counts = {'enqueued': 0, 'published': 0, 'coalesced': 0, 'retries': 0, 'failed': 0}
+
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"command-outbox-{index}", daemon=True)
+            for index in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.drain)
+
+    def _open_db(self, path: str):
+        import sqlite3
+
+        # Autocommit, every change is written before the call that made it returns
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, device TEXT, topic TEXT, payload TEXT, attempts INTEGER)")
+        rows = self._db.execute("SELECT id, device, topic, payload, attempts FROM outbox ORDER BY id").fetchall()
+        now = time.monotonic()
+        for command_id, device, topic, payload, attempts in rows:
+            superseded = self._pending.get((device, topic))
+            if superseded is not None:
+                self._db.execute("DELETE FROM outbox WHERE id = ?", (superseded['id'],))
+            self._pending[(device, topic)] = {
+                'id': command_id, 'device': device, 'topic': topic, 'payload': payload,
+                'attempts': attempts, 'enqueued_at': now, 'not_before': now
+            }
+            self._set_outcome(command_id, 'queued')
+            self._next_id = command_id + 1
+        if self._pending:
+            logger.info("Restored queued commands", extra={'commands': len(self._pending), 'path': path})
+
+    def enqueue(self, device: str, topic: str, message_json: str) -> dict:
+        """Queue a command for publishing, replacing any queued command for the same device and topic.
+
+        Args:
+            device: The device key, commands for a device are published in order
+            topic: The MQTT topic to publish to
+            message_json: The JSON payload
+
+        Returns:
+            A dict with status 'queued', the command ID, the queue depth and the ID of the
+            command it replaced, if any
+        """
+        key = (device, topic)
+        with self._condition:
+            now = time.monotonic()
+            command = {
+                'id': self._next_id, 'device': device, 'topic': topic, 'payload': message_json,
+                'attempts': 0, 'enqueued_at': now, 'not_before': now
+            }
+            self._next_id += 1
+            superseded = self._pending.get(key)
+            # Assigning to an existing key keeps its place in the queue
+            self._pending[key] = command
+            if self._db is not None:
+                if superseded is not None:
+                    self._db.execute("DELETE FROM outbox WHERE id = ?", (superseded['id'],))
+                self._db.execute("INSERT INTO outbox VALUES (?, ?, ?, ?, 0)", (command['id'], device, topic, message_json))
+            self._counts['enqueued'] += 1
+            self._set_outcome(command['id'], 'queued')
+            if superseded is not None:
+                self._counts['coalesced'] += 1
+                self._set_outcome(superseded['id'], 'superseded', f"Replaced by command {command['id']}")
+            queue_depth = len(self._pending)
+            self._condition.notify()
+
+        self._metrics.inc("outbox_enqueued_total", topic=topic)
+        if superseded is not None:
+            self._metrics.inc("outbox_coalesced_total", topic=topic)
+        return {
+            'status': 'queued',
+            'command_id': command['id'],
+            'queue_depth': queue_depth,
+            'replaced_command_id': superseded['id'] if superseded is not None else None
+        }
+
+    def _topic_bucket(self, topic: str) -> TokenBucket:
+        bucket = self._topic_buckets.get(topic)
+        if bucket is None:
+            bucket = self._topic_buckets[topic] = TokenBucket(self._topic_rate, self._topic_burst)
+        return bucket
+
+    def _take_ready(self) -> tuple:
+        # Returns the oldest command that may be published now, or None and how long to wait
+        now = time.monotonic()
+        wait = None
+        for key, command in self._pending.items():
+            if key in self._in_flight:
+                continue
+            topic_bucket = self._topic_bucket(command['topic'])
+            ready_in = max(command['not_before'] - now, self._account_bucket.wait_time(now), topic_bucket.wait_time(now))
+            if ready_in > 0:
+                wait = ready_in if wait is None else min(wait, ready_in)
+                continue
+            self._account_bucket.take(now)
+            topic_bucket.take(now)
+            del self._pending[key]
+            self._in_flight.add(key)
+            self._set_outcome(command['id'], 'publishing')
+            return command, None
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._condition:
+                command, wait = self._take_ready()
+                while command is None:
+                    if self._closed:
+                        return
+                    self._condition.wait(wait)
+                    command, wait = self._take_ready()
+            self._publish(command)
+
+    def _publish(self, command: dict):
+        key = (command['device'], command['topic'])
+        command['attempts'] += 1
+        try:
+            self._publisher.publish(command['topic'], command['payload'], qos=1)
+        except Exception as e:
+            self._retry_or_fail(command, e)
+            return
+
+        delay_ms = (time.monotonic() - command['enqueued_at']) * 1000
+        with self._condition:
+            self._in_flight.discard(key)
+            self._counts['published'] += 1
+            self._set_outcome(command['id'], 'published')
+            self._published_at.append(time.monotonic())
+            if self._db is not None:
+                self._db.execute("DELETE FROM outbox WHERE id = ?", (command['id'],))
+            self._condition.notify_all()
+        self._metrics.inc("outbox_published_total", topic=command['topic'])
+        self._metrics.observe("outbox_delay_ms", delay_ms, topic=command['topic'])
+
+    def _retry_or_fail(self, command: dict, error: Exception):
+        key = (command['device'], command['topic'])
+        retry = is_retryable_publish_error(error) and command['attempts'] < self.max_attempts
+        with self._condition:
+            self._in_flight.discard(key)
+            if key in self._pending:
+                # A newer command for the device replaced this one while it was being published
+                retry = False
+                self._counts['coalesced'] += 1
+                outcome = 'superseded'
+                self._set_outcome(command['id'], outcome, f"Replaced by command {self._pending[key]['id']}")
+            elif retry:
+                # Exponential backoff with full jitter spreads retries from many commands apart
+                backoff = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (command['attempts'] - 1))
+                command['not_before'] = time.monotonic() + random.uniform(0, backoff)
+                self._pending[key] = command
+                self._pending.move_to_end(key, last=False)
+                self._counts['retries'] += 1
+                outcome = 'retry'
+                self._set_outcome(command['id'], 'retrying', str(error))
+            else:
+                self._counts['failed'] += 1
+                outcome = 'failed'
+                self._set_outcome(command['id'], outcome, str(error))
+            if self._db is not None:
+                if retry:
+                    self._db.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (command['attempts'], command['id']))
+                else:
+                    self._db.execute("DELETE FROM outbox WHERE id = ?", (command['id'],))
+            self._condition.notify_all()
+
+        if outcome == 'retry':
+            self._metrics.inc("outbox_retries_total", topic=command['topic'])
+            logger.warning("Retrying command publish", extra={'device': command['device'], 'topic': command['topic'], 'attempt': command['attempts'], 'error': str(error)})
+        elif outcome == 'failed':
+            self._metrics.inc("outbox_failed_total", topic=command['topic'])
+            if self._debouncer is not None:
+                self._debouncer.forget(command['device'], command['topic'], command['payload'])
+            logger.error("Command publish failed", extra={'device': command['device'], 'topic': command['topic'], 'attempts': command['attempts'], 'error': str(error)})
+
+    def _set_outcome(self, command_id: int, status: str, detail: str = None):
+        # Called with the lock held; only the most recent commands are remembered
+        self._outcomes[command_id] = {'status': status, 'detail': detail} if detail else {'status': status}
+        self._outcomes.move_to_end(command_id)
+        while len(self._outcomes) > self.status_history:
+            self._outcomes.popitem(last=False)
+
+    def status(self, command_id: int) -> dict:
+        """Return what happened to a queued command.
+
+        Args:
+            command_id: The ID returned by enqueue()
+
+        Returns:
+            A dict with the command's status: 'queued', 'publishing', 'retrying',
+            'published', 'superseded' or 'failed', and any error or replacing command as
+            'detail'; or status 'unknown' if the command is too old or was never queued
+        """
+        with self._condition:
+            outcome = self._outcomes.get(command_id)
+        return {'command_id': command_id, **(outcome or {'status': 'unknown'})}
+
+    def drain(self, timeout_seconds: float = 5.0) -> bool:
+        """Wait until every queued command is published or has failed, used on shutdown.
+
+        Returns:
+            True if the queue emptied within the timeout
+        """
+        deadline = time.monotonic() + timeout_seconds
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def close(self):
+        """Stop the workers once nothing is ready to publish; queued commands stay in SQLite, if configured."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def depth(self) -> tuple:
+        """Return the number of queued and in-flight commands."""
+        with self._condition:
+            return len(self._pending), len(self._in_flight)
+
+    def stats(self) -> dict:
+        """Return queue depth, command counts and the publish rate over the last minute."""
+        with self._condition:
+            now = time.monotonic()
+            recent = len(self._published_at) - bisect.bisect_left(self._published_at, now - 60)
+            return {
+                'queued': len(self._pending),
+                'in_flight': len(self._in_flight),
+                **self._counts,
+                'published_per_second': round(recent / 60, 2),
+                'persistent': self._db is not None
+            }
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads AWS settings at import time; nothing here talks to AWS
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+
+class RecordingMetrics:
+    """Records what a subsystem reports, in place of the app's MetricsRegistry."""
+
+    def __init__(self):
+        self.counters = {}
+        self.observations = {}
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, **labels):
+        self.observations.setdefault(name, []).append(value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+
+@pytest.fixture
+def metrics():
+    return RecordingMetrics()
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from agent_executor import AgentBusyError, AgentExecutor
+
+
+class FakeEventLoopMetrics:
+    def __init__(self):
+        self.accumulated_usage = {'inputTokens': 0, 'outputTokens': 0, 'totalTokens': 0}
+        self.accumulated_metrics = {'latencyMs': 0}
+
+
+class FakeAgent:
+    """Answers a prompt once `release` is set, or raises for the prompt 'fail'."""
+
+    def __init__(self):
+        self.event_loop_metrics = FakeEventLoopMetrics()
+        self.callback_handler = None
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, prompt):
+        self.started.set()
+        self.release.wait(5)
+        if prompt == 'fail':
+            raise RuntimeError('model unavailable')
+        self.event_loop_metrics.accumulated_usage['inputTokens'] += 10
+        return f"answer to {prompt}"
+
+
+def test_turn_result_and_token_metrics(metrics):
+    executor = AgentExecutor(max_workers=1, max_queued=0, metrics=metrics)
+    agent = FakeAgent()
+    agent.release.set()
+    assert executor.submit(agent, 'hello', None).result(5) == 'answer to hello'
+    assert metrics.counters['agent_turns_total'] == 1
+    assert metrics.counters['model_tokens_total'] == 10
+    assert executor.stats()['completed'] == 1
+
+
+def test_second_turn_for_busy_agent_is_rejected(metrics):
+    executor = AgentExecutor(max_workers=2, max_queued=2, metrics=metrics)
+    agent = FakeAgent()
+    future = executor.submit(agent, 'first', None)
+    agent.started.wait(5)
+    with pytest.raises(AgentBusyError):
+        executor.submit(agent, 'second', None)
+    agent.release.set()
+    future.result(5)
+    # The agent's lock is released when its turn ends
+    assert executor.submit(agent, 'third', None).result(5) == 'answer to third'
+    assert executor.stats()['rejected'] == 1
+
+
+def test_full_queue_is_rejected_without_holding_the_agent(metrics):
+    executor = AgentExecutor(max_workers=1, max_queued=0, metrics=metrics)
+    busy, other = FakeAgent(), FakeAgent()
+    future = executor.submit(busy, 'first', None)
+    busy.started.wait(5)
+    with pytest.raises(AgentBusyError, match="queue is full"):
+        executor.submit(other, 'second', None)
+    busy.release.set()
+    future.result(5)
+    other.release.set()
+    assert executor.submit(other, 'second', None).result(5) == 'answer to second'
+
+
+def test_failed_turn_releases_the_agent(metrics):
+    executor = AgentExecutor(max_workers=1, max_queued=0, metrics=metrics)
+    agent = FakeAgent()
+    agent.release.set()
+    with pytest.raises(RuntimeError):
+        executor.submit(agent, 'fail', None).result(5)
+    assert executor.submit(agent, 'again', None).result(5) == 'answer to again'
+    assert executor.stats()['in_flight'] == 0
+
+
+def test_update_agent_waits_for_no_turn(metrics):
+    executor = AgentExecutor(max_workers=1, max_queued=0, metrics=metrics)
+    agent = FakeAgent()
+    agent.messages = []
+    future = executor.submit(agent, 'first', None)
+    agent.started.wait(5)
+    # A running turn owns the agent's messages
+    assert not executor.update_agent(agent, lambda a: a.messages.append('exchange'))
+    agent.release.set()
+    future.result(5)
+    assert executor.update_agent(agent, lambda a: a.messages.append('exchange'))
+    assert agent.messages == ['exchange']
@@ -0,0 +1,219 @@
+import atexit
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from device_commands import CommandDebouncer, CommandOutbox, CommandScheduler, TokenBucket, is_retryable_publish_error
+
+
+def throttled():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'Publish')
+
+
+class FakePublisher:
+    """Records publishes, raising the queued errors first; publishes wait while `paused` is clear."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.published = []
+        self.attempts = 0
+        self.paused = threading.Event()
+        self.paused.set()
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=1):
+        self.paused.wait(5)
+        with self._lock:
+            self.attempts += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            self.published.append((topic, payload))
+
+
+@pytest.fixture
+def make_outbox(metrics):
+    outboxes = []
+
+    def make(publisher, **settings):
+        settings.setdefault('retry_base_seconds', 0.01)
+        outbox = CommandOutbox(publisher, metrics, **settings)
+        outboxes.append(outbox)
+        return outbox
+
+    yield make
+    for outbox in outboxes:
+        outbox.close()
+        # Don't wait at exit for commands a test left queued on purpose
+        atexit.unregister(outbox.drain)
+
+
+def test_outbox_coalesces_queued_commands_for_a_device(make_outbox, metrics):
+    publisher = FakePublisher()
+    publisher.paused.clear()
+    outbox = make_outbox(publisher, workers=1)
+    # The worker takes the first command and waits in publish, so the next two queue up
+    outbox.enqueue("feeder", "cat/feeder", '{"action": "warmup"}')
+    time.sleep(0.05)
+
+    forward = outbox.enqueue("feeder", "cat/feeder", '{"action": "forward"}')
+    stop = outbox.enqueue("feeder", "cat/feeder", '{"action": "stop"}')
+    publisher.paused.set()
+
+    assert stop['replaced_command_id'] == forward['command_id']
+    assert outbox.drain(timeout_seconds=5)
+    assert publisher.published == [("cat/feeder", '{"action": "warmup"}'), ("cat/feeder", '{"action": "stop"}')]
+    assert outbox.status(forward['command_id'])['status'] == 'superseded'
+    assert outbox.status(stop['command_id'])['status'] == 'published'
+    assert metrics.counters['outbox_coalesced_total'] == 1
+
+
+def test_outbox_retries_throttled_publishes(make_outbox, metrics):
+    publisher = FakePublisher(errors=[throttled(), throttled()])
+    outbox = make_outbox(publisher, max_attempts=3)
+
+    command = outbox.enqueue("feeder", "cat/feeder", '{"action": "stop"}')
+
+    assert outbox.drain(timeout_seconds=5)
+    assert publisher.attempts == 3
+    assert outbox.status(command['command_id'])['status'] == 'published'
+    assert outbox.stats()['retries'] == 2
+    assert metrics.counters['outbox_retries_total'] == 2
+
+
+def test_outbox_gives_up_after_max_attempts_and_forgets_the_debounced_command(make_outbox):
+    publisher = FakePublisher(errors=[throttled(), throttled()])
+    debouncer = CommandDebouncer(window_seconds=60)
+    outbox = make_outbox(publisher, debouncer=debouncer, max_attempts=2)
+    assert debouncer.should_send("feeder", "cat/feeder", '{"action": "stop"}')
+
+    command = outbox.enqueue("feeder", "cat/feeder", '{"action": "stop"}')
+
+    assert outbox.drain(timeout_seconds=5)
+    status = outbox.status(command['command_id'])
+    assert status['status'] == 'failed'
+    assert 'ThrottlingException' in status['detail']
+    # The failed command may be sent again straight away
+    assert debouncer.should_send("feeder", "cat/feeder", '{"action": "stop"}')
+
+
+def test_outbox_does_not_retry_permanent_errors(make_outbox):
+    publisher = FakePublisher(errors=[ValueError("bad payload")])
+    outbox = make_outbox(publisher)
+
+    command = outbox.enqueue("feeder", "cat/feeder", '{"action": "stop"}')
+
+    assert outbox.drain(timeout_seconds=5)
+    assert publisher.attempts == 1
+    assert outbox.status(command['command_id']) == {'command_id': command['command_id'], 'status': 'failed', 'detail': 'bad payload'}
+
+
+def test_outbox_restores_queued_commands_after_a_restart(make_outbox, tmp_path):
+    db_path = str(tmp_path / "outbox.db")
+    # Without workers nothing is published before the restart
+    first = make_outbox(FakePublisher(), db_path=db_path, workers=0)
+    first.enqueue("feeder", "cat/feeder", '{"action": "forward"}')
+    first.enqueue("feeder", "cat/feeder", '{"action": "stop"}')
+    stop_lights = first.enqueue("lights", "house/lights", '{"action": "off"}')
+    first.close()
+
+    publisher = FakePublisher()
+    second = make_outbox(publisher, db_path=db_path)
+
+    assert second.drain(timeout_seconds=5)
+    assert sorted(publisher.published) == [("cat/feeder", '{"action": "stop"}'), ("house/lights", '{"action": "off"}')]
+    assert second.status(stop_lights['command_id'])['status'] == 'published'
+    # New commands continue the restored IDs
+    assert second.enqueue("feeder", "cat/feeder", '{"action": "forward"}')['command_id'] == stop_lights['command_id'] + 1
+
+
+def test_outbox_status_is_unknown_for_commands_beyond_the_history(make_outbox):
+    outbox = make_outbox(FakePublisher(), status_history=2)
+    first = outbox.enqueue("a", "topic", "{}")
+    outbox.enqueue("b", "topic", "{}")
+    outbox.enqueue("c", "topic", "{}")
+
+    assert outbox.status(first['command_id'])['status'] == 'unknown'
+    assert outbox.status(999)['status'] == 'unknown'
+
+
+def test_token_bucket_allows_a_burst_then_refills_at_the_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = time.monotonic()
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0
+        bucket.take(now)
+
+    assert bucket.wait_time(now) == pytest.approx(0.1)
+    assert bucket.wait_time(now + 0.1) == 0
+    # Idle time never fills the bucket past its burst
+    assert bucket.wait_time(now + 60) == 0
+    bucket.take(now + 60)
+    bucket.take(now + 60)
+    assert bucket.wait_time(now + 60) > 0
+
+
+@pytest.mark.parametrize('rate, burst', [(10, 0.5), (10, 0), (0, 5), (-1, 5)])
+def test_token_bucket_rejects_settings_that_never_admit_a_token(rate, burst):
+    with pytest.raises(ValueError):
+        TokenBucket(rate, burst)
+
+
+def test_outbox_rejects_a_topic_burst_below_one(metrics):
+    with pytest.raises(ValueError):
+        CommandOutbox(FakePublisher(), metrics, topic_burst=0.5)
+
+
+def test_retryable_errors():
+    assert is_retryable_publish_error(throttled())
+    assert not is_retryable_publish_error(ClientError({'Error': {'Code': 'UnauthorizedException'}}, 'Publish'))
+    assert not is_retryable_publish_error(ValueError("bad payload"))
+
+
+def test_debouncer_only_drops_an_exact_repeat_within_the_window():
+    debouncer = CommandDebouncer(window_seconds=60)
+    assert debouncer.should_send("feeder", "cat/feeder", "forward")
+    assert not debouncer.should_send("feeder", "cat/feeder", "forward")
+    assert debouncer.should_send("feeder", "cat/feeder", "stop")
+    assert debouncer.should_send("feeder", "cat/feeder", "forward")
+    assert debouncer.should_send("lights", "house/lights", "forward")
+    assert debouncer.suppressed == 1
+
+
+def test_scheduler_runs_a_command_after_its_delay():
+    scheduler = CommandScheduler()
+    ran = threading.Event()
+
+    scheduler.schedule("feeder", 0.05, ran.set)
+
+    assert ran.wait(2)
+    assert scheduler.pending() == {}
+
+
+def test_scheduler_cancel_drops_the_pending_command():
+    scheduler = CommandScheduler()
+    ran = threading.Event()
+    scheduler.schedule("feeder", 0.1, ran.set)
+
+    assert scheduler.cancel("feeder")
+    assert not scheduler.cancel("feeder")
+    assert not ran.wait(0.3)
+
+
+def test_scheduler_merge_keeps_the_later_deadline_and_cancel_replaces_it():
+    scheduler = CommandScheduler('merge')
+    calls = []
+    scheduler.schedule("feeder", 60, calls.append, "first")
+
+    assert scheduler.schedule("feeder", 5, calls.append, "second") == pytest.approx(60, abs=1)
+    assert scheduler.schedule("feeder", 5, calls.append, "third", policy='cancel') == pytest.approx(5, abs=1)
+
+    scheduler.flush()
+    assert calls == ["third"]
+    assert scheduler.pending() == {}
+
+
+def test_scheduler_rejects_an_unknown_overlap_policy():
+    with pytest.raises(ValueError):
+        CommandScheduler('queue')
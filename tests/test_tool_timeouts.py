@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+import app
+
+
+def slow_tool():
+    time.sleep(1.5)
+    return {'status': 'success'}
+
+
+slow_tool.timeout_seconds = 0.2
+
+
+def test_timed_out_tool_is_pending_and_does_not_hold_up_the_turn():
+    async_tool = app.make_async_tool(slow_tool)
+
+    async def turn():
+        return await async_tool()
+
+    # Strands runs each turn's event loop with asyncio.run, which waits for the loop's
+    # default executor when it closes
+    start = time.perf_counter()
+    result = asyncio.run(turn())
+    elapsed = time.perf_counter() - start
+
+    assert result['status'] == 'pending'
+    assert elapsed < 1.0
+
+
+def test_blocking_tool_result_is_returned():
+    def quick_tool(value):
+        return {'status': 'success', 'value': value}
+
+    async_tool = app.make_async_tool(quick_tool)
+    assert asyncio.run(async_tool(3)) == {'status': 'success', 'value': 3}